@@ -0,0 +1,67 @@
+import config
+
+atlases = []
+stats = { 'allocated': 0, 'released': 0, 'full': 0 }
+
+class SlotAllocator:
+    def __init__(self, size, slot):
+        self.per_row = size // slot
+        self.slot = slot
+        self.free = list(range(self.per_row * self.per_row - 1, -1, -1))
+
+    def allocate(self):
+        if len(self.free) == 0:
+            return None
+        return self.free.pop()
+
+    def release(self, index):
+        self.free.append(index)
+
+    def position(self, index):
+        return ((index % self.per_row) * self.slot, (index // self.per_row) * self.slot)
+
+    @property
+    def used(self):
+        return self.per_row * self.per_row - len(self.free)
+
+class Atlas:
+    def __init__(self):
+        from pyglet import image
+        self.texture = image.Texture.create(config.ATLAS_SIZE, config.ATLAS_SIZE)
+        self.slots = SlotAllocator(config.ATLAS_SIZE, config.ATLAS_SLOT)
+
+def fits(decoded):
+    if not len(decoded.layout) == 1:
+        return False
+    width, height, duration, offset = decoded.layout[0]
+    return width + 2 * config.ATLAS_PADDING <= config.ATLAS_SLOT and height + 2 * config.ATLAS_PADDING <= config.ATLAS_SLOT
+
+def upload(decoded):
+    if not fits(decoded):
+        return None
+    for atlas in atlases:
+        index = atlas.slots.allocate()
+        if not index == None:
+            break
+    else:
+        if len(atlases) >= config.ATLAS_MAX:
+            stats['full'] += 1
+            return None
+        atlas = Atlas()
+        atlases.append(atlas)
+        index = atlas.slots.allocate()
+    x, y = atlas.slots.position(index)
+    region = decoded.upload_into(atlas.texture, x + config.ATLAS_PADDING, y + config.ATLAS_PADDING)
+    region.atlas_slot = (atlas, index)
+    stats['allocated'] += 1
+    return region
+
+def release(image):
+    slot = getattr(image, 'atlas_slot', None)
+    if not slot == None:
+        image.atlas_slot = None
+        slot[0].slots.release(slot[1])
+        stats['released'] += 1
+
+def snapshot():
+    return dict(stats, atlases=len(atlases), slots=sum(atlas.slots.used for atlas in atlases))
@@ -0,0 +1,246 @@
+from urllib.parse import urlsplit
+import subprocess
+import threading
+import argparse
+import tempfile
+import config
+import time
+import sys
+import os
+
+class Probe:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_rss = 0
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='Probe', daemon=True)
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        self.peak_threads = max(self.peak_threads, threading.active_count() - 1)
+        self.peak_rss = max(self.peak_rss, rss())
+
+    def __enter__(self):
+        self.sample()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.done.set()
+        self.thread.join()
+        self.sample()
+
+def rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return 0
+
+def percentile(values, p):
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def report(name, latencies, size, elapsed, probe):
+    print('%-16s %6d req %8.1f req/s %8.2f MB/s   p50 %7.1f ms   p99 %7.1f ms   threads %3d   rss %7.1f MB' % (
+        name, len(latencies), len(latencies) / elapsed, size / elapsed / 2**20,
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+        probe.peak_threads, probe.peak_rss / 2**20))
+
+def wait_for(pending, timeout):
+    deadline = time.perf_counter() + timeout
+    with pending:
+        while pending.count > 0 and time.perf_counter() < deadline:
+            pending.wait(deadline - time.perf_counter())
+
+class Pending(threading.Condition):
+    def __init__(self, count):
+        super().__init__()
+        self.count = count
+
+    def finish(self):
+        with self:
+            self.count -= 1
+            self.notify_all()
+
+def bench_search(pages, limit):
+    import api
+    latencies = []
+    size = 0
+    started = time.perf_counter()
+    with Probe() as probe:
+        for page in range(1, pages + 1):
+            t = time.perf_counter()
+            posts = list(api.search(limit, tags='bench', page=page))
+            latencies.append(time.perf_counter() - t)
+            size += sum(len(str(post.data)) for post in posts)
+    report('search', latencies, size, time.perf_counter() - started, probe)
+
+def bench_queue_request(urls, timeout):
+    import api
+    latencies = []
+    sizes = []
+    pending = Pending(len(urls))
+    def handlers(t):
+        def response_handler(response):
+            latencies.append(time.perf_counter() - t)
+            sizes.append(len(response.content))
+            pending.finish()
+        return response_handler, lambda e: pending.finish()
+    started = time.perf_counter()
+    with Probe() as probe:
+        for url in urls:
+            response_handler, error_handler = handlers(time.perf_counter())
+            api.queue_request(url, response_handler=response_handler, error_handler=error_handler)
+        wait_for(pending, timeout)
+    report('queue_request', latencies, sum(sizes), time.perf_counter() - started, probe)
+
+def bench_thread_sessions(urls, timeout):
+    import requests
+    from queue import Queue, Empty
+    latencies = []
+    sizes = []
+    pending = Pending(len(urls))
+    queue = Queue()
+    stopped = threading.Event()
+    threads = []
+    def session_thread():
+        session = requests.session()
+        while not stopped.is_set():
+            try: url, t = queue.get(True, 0.1)
+            except Empty: continue
+            try:
+                response = session.get(url)
+                latencies.append(time.perf_counter() - t)
+                sizes.append(len(response.content))
+            except requests.RequestException:
+                pass
+            queue.task_done()
+            pending.finish()
+        session.close()
+    started = time.perf_counter()
+    with Probe() as probe:
+        for url in urls:
+            if queue.unfinished_tasks >= len(threads) and len(threads) < config.CONCURRENT_LIMIT:
+                threads.append(threading.Thread(target=session_thread, name='Session-' + str(len(threads) + 1), daemon=True))
+                threads[-1].start()
+            queue.put_nowait((url, time.perf_counter()))
+        wait_for(pending, timeout)
+    stopped.set()
+    for thread in threads:
+        thread.join()
+    report('thread_sessions', latencies, sum(sizes), time.perf_counter() - started, probe)
+
+def bench_post_loads(posts, method, timeout):
+    from post import Post
+    latencies = []
+    sizes = []
+    pending = Pending(len(posts))
+    started = time.perf_counter()
+    with Probe() as probe:
+        for post in [Post(post.data) for post in posts]:
+            t = time.perf_counter()
+            def file_handler(x, t=t):
+                latencies.append(time.perf_counter() - t)
+                sizes.append(os.path.getsize(x[1]))
+                pending.finish()
+            getattr(post, method)(file_handler)
+        wait_for(pending, timeout)
+    report(method, latencies, sum(sizes), time.perf_counter() - started, probe)
+
+def bench_download_posts(posts, target):
+    import download
+    started = time.perf_counter()
+    with Probe() as probe:
+        download.download_posts(posts, target)
+    elapsed = time.perf_counter() - started
+    size = sum(os.path.getsize(os.path.join(target, name)) for name in os.listdir(target))
+    report('download_posts', [elapsed / max(len(posts), 1)] * len(posts), size, elapsed, probe)
+
+class StubProcess:
+    def __init__(self, args, media_url=None):
+        command = [sys.executable, '-m', 'benchmarks.stubserver', '--port', '0', '--latency', str(args.latency),
+                   '--error-rate', str(args.error_rate), '--drop-rate', str(args.drop_rate)]
+        if not args.bandwidth == None:
+            command += ['--bandwidth', str(args.bandwidth)]
+        if not args.throttle == None:
+            command += ['--throttle', str(args.throttle)]
+        if not media_url == None:
+            command += ['--media-url', media_url]
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+        self.url = self.process.stdout.readline().split()[-1]
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput and latency benchmark for the fetch layer.')
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--bandwidth', type=float, default=None)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--throttle', type=int, default=None)
+    parser.add_argument('--drop-rate', type=float, default=0)
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--downloads', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--respect-limits', action='store_true', help='keep the configured rate limits')
+    args = parser.parse_args()
+
+    media = StubProcess(args)
+    index = StubProcess(args, media.url)
+
+    workdir = tempfile.mkdtemp(prefix='e621bench')
+    config.BASE_URL = index.url
+    config.SEARCH_CACHE = os.path.join(workdir, 'search', '')
+    config.MEDIA_CACHE = os.path.join(workdir, 'media', '')
+    config.PARTIAL_CACHE = os.path.join(workdir, 'media', 'partial', '')
+    config.METRICS_JSON = os.path.join(workdir, 'metrics.json')
+    config.METRICS_PROM = os.path.join(workdir, 'metrics.prom')
+    config.DOWNLOADS = os.path.join(workdir, 'downloads', '')
+    config.METADATA = os.path.join(workdir, 'meta.ini')
+    config.METADATA_DB = os.path.join(workdir, 'meta.db')
+    os.makedirs(config.DOWNLOADS)
+
+    import ratelimit
+    ratelimit.api_host = urlsplit(index.url).netloc
+    if not args.respect_limits:
+        ratelimit.api_bucket = ratelimit.TokenBucket(10**6, 10**6)
+        ratelimit.media_buckets[urlsplit(media.url).netloc] = ratelimit.TokenBucket(10**6, 10**6)
+
+    import searchcache
+    import metrics
+    import engine
+    import api
+    print('stub api %s  media %s  latency %.0f ms' % (index.url, media.url, args.latency * 1000))
+    bench_search(args.pages, args.limit)
+    searchcache.clear_session()
+    posts = list(api.search(args.limit, tags='bench', page=1))
+    bench_queue_request([post.preview_url for post in posts], args.timeout)
+    bench_thread_sessions([post.preview_url for post in posts], args.timeout)
+    bench_post_loads(posts, 'load_preview', args.timeout)
+    bench_post_loads(posts, 'load_file', args.timeout)
+    bench_download_posts(posts[:args.downloads], config.DOWNLOADS)
+    print('engine', metrics.snapshot()['counters'], 'concurrency', engine.controller.current)
+    for name, histogram in sorted(metrics.snapshot()['histograms'].items()):
+        print('  %-16s n %6d   p50 %7.1f ms   p99 %7.1f ms' % (name, histogram['count'], histogram['p50'] * 1000, histogram['p99'] * 1000))
+    metrics.export()
+    print('metrics written to', config.METRICS_JSON, 'and', config.METRICS_PROM)
+    engine.stop()
+    index.stop()
+    media.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import jsonstream
+import random
+import json
+import time
+import sys
+
+def synthetic_posts(count):
+    posts = []
+    for i in range(count):
+        md5 = '%032x' % random.getrandbits(128)
+        posts.append({
+            'id': 2000000 - i, 'md5': md5, 'rating': random.choice('sqe'),
+            'tags': ' '.join('tag_%d' % random.randrange(5000) for j in range(40)),
+            'score': random.randrange(-10, 500), 'fav_count': random.randrange(1000),
+            'file_ext': 'png', 'file_size': random.randrange(10**4, 10**7),
+            'width': 1920, 'height': 1080, 'preview_width': 150, 'preview_height': 84,
+            'sample_width': 850, 'sample_height': 478,
+            'file_url': 'https://static1.e621.net/data/%s/%s/%s.png' % (md5[:2], md5[2:4], md5),
+            'preview_url': 'https://static1.e621.net/data/preview/%s/%s/%s.jpg' % (md5[:2], md5[2:4], md5),
+            'sample_url': 'https://static1.e621.net/data/sample/%s/%s/%s.jpg' % (md5[:2], md5[2:4], md5),
+            'description': 'x' * random.randrange(400), 'sources': [], 'children': '',
+            'created_at': {'json_class': 'Time', 's': 1500000000, 'n': 0},
+        })
+    return posts
+
+def arriving(body, chunk_size, bandwidth):
+    delay = chunk_size / bandwidth
+    for i in range(0, len(body), chunk_size):
+        time.sleep(delay)
+        yield body[i:i+chunk_size]
+
+def buffered(chunks):
+    for post in json.loads(b''.join(chunks)):
+        yield post
+
+def first_post(decode, body, chunk_size, bandwidth):
+    started = time.perf_counter()
+    first = None
+    count = 0
+    for post in decode(arriving(body, chunk_size, bandwidth)):
+        if first == None:
+            first = time.perf_counter() - started
+        count += 1
+    return first, time.perf_counter() - started, count
+
+def main(count=500, bandwidth=2*1024*1024, chunk_size=16384):
+    body = json.dumps(synthetic_posts(count)).encode('utf8')
+    print('%d posts, %d bytes, %d B/s, %d B chunks' % (count, len(body), bandwidth, chunk_size))
+    for name, decode in (('buffered', buffered), ('streaming', jsonstream.iter_array)):
+        first, total, posts = first_post(decode, body, chunk_size, bandwidth)
+        print('%-10s first post %7.1f ms    all %d posts %7.1f ms' % (name, first*1000, posts, total*1000))
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,145 @@
+from benchmarks.first_post import synthetic_posts
+import imagecache
+import gridview
+import config
+import layout
+import random
+import time
+import sys
+
+class Sprite:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.scale = 1
+        self.x = 0
+        self.y = 0
+        self.image = None
+        self.visible = True
+
+class Translate:
+    x = 0
+    y = 0
+
+def cells(count):
+    return [(post['preview_width'] * random.uniform(0.5, 1), post['preview_height'] * random.uniform(0.5, 1)) for post in synthetic_posts(count)]
+
+def legacy_layout(sizes):
+    _column_width = []
+    _row_height = []
+    row_width = []
+    for index, (width, height) in enumerate(sizes):
+        column, row = index % 11, index // 11
+        if len(_column_width) > column:
+            _column_width[column] = max(_column_width[column], width)
+        else:
+            _column_width.append(width)
+        if len(_row_height) > row:
+            _row_height[row] = max(_row_height[row], height)
+        else:
+            _row_height.append(height)
+    for index in range(len(sizes)):
+        column, row = index % 11, index // 11
+        if len(row_width) > row:
+            row_width[row] += _column_width[column] + 20
+        else:
+            row_width.append(_column_width[column] + 20)
+    column_width = [width + 20 for width in _column_width[:-1]] + _column_width[-1:]
+    row_height = [height + 20 for height in _row_height[:-1]] + _row_height[-1:]
+    row_width = [width - 20 for width in row_width][::-1]
+    return column_width, row_height, row_width
+
+def legacy_frame(sprites, sizes, column_width, row_height, row_width, width, height, x, y):
+    for index, sprite in enumerate(sprites):
+        column = index % 11
+        row = len(row_height) - 1 - index // 11
+        padding_x = 20 if column + 1 < len(column_width) else 0
+        padding_y = 20 if row + 1 < len(row_height) else 0
+        image_width = sprite.width / sprite.scale
+        image_height = sprite.height / sprite.scale
+        cell_width, cell_height = sizes[index]
+        sprite.scale = min(cell_width / image_width, cell_height / image_height)
+        sprite.x = sum(column_width[:column]) + (width - row_width[row])/2 + (column_width[column] - sprite.width - padding_x)/2 - x
+        sprite.y = sum(row_height[:row]) + (height - sum(row_height))/2 + (row_height[row] - sprite.height - padding_y)/2 + y
+
+def grid_view(count, width, height):
+    import api
+    from post import Post
+    view = gridview.GridView(Translate(), lambda image: Sprite(*image), lambda: None, lambda page: None,
+                             lambda first, last: None, lambda: None)
+    view.dimensions = (width, height)
+    with view.lock:
+        for index, data in enumerate(synthetic_posts(count)):
+            data['preview_width'] = int(data['preview_width'] * random.uniform(0.5, 1))
+            data['preview_height'] = int(data['preview_height'] * random.uniform(0.5, 1))
+            post = Post(data)
+            size = (post.preview_width, post.preview_height)
+            imagecache.put_texture((post.id, 'preview'), size, size[0] * size[1] * 4, index)
+            view.add_post(index // config.GRID_PAGE_SIZE + 1, post)
+        view.relayout()
+    while view.update(0, 0):
+        pass
+    return view
+
+def view_frame(view):
+    view.update(0, 0)
+
+def view_scroll_frame(view):
+    view.scroll = (view.scroll + config.SCROLL_STEP) % max(view.grid.height - view.dimensions[1], 1)
+    view.update(0, 0)
+
+def view_dirty_frame(view):
+    view.invalidate()
+    view.update(0, 0)
+
+def grid_relayout(grid, sprites, sizes):
+    grid.build(sizes)
+    for index, sprite in enumerate(sprites):
+        image_width = sprite.width / sprite.scale
+        image_height = sprite.height / sprite.scale
+        cell_width, cell_height = sizes[index]
+        sprite.scale = min(cell_width / image_width, cell_height / image_height)
+        sprite.x, sprite.y = grid.place(index, sprite.width, sprite.height)
+
+def scroll_frames(grid, height, frames):
+    visible = range(0)
+    live = set()
+    for frame in range(frames):
+        top = frame * 37 % max(grid.height - height, 1)
+        cells = grid.cells(top, top + height, 2)
+        if not cells == visible:
+            live -= set(visible) - set(cells)
+            live |= set(cells) - set(visible)
+            visible = cells
+    return len(live)
+
+def timeit(func, *args, repeat=200):
+    started = time.perf_counter()
+    for i in range(repeat):
+        func(*args)
+    return (time.perf_counter() - started) / repeat
+
+def main(count=500, repeat=200):
+    sizes = cells(count)
+    sprites = [Sprite(150, 84) for size in sizes]
+    legacy = timeit(legacy_frame, sprites, sizes, *legacy_layout(sizes), 1920, 1080, 0, 0, repeat=repeat)
+    view = grid_view(count, 1920, 1080)
+    frame = timeit(view_frame, view, repeat=repeat)
+    dirty = timeit(view_dirty_frame, view, repeat=repeat)
+    placed = len(view.sprites)
+    scrolled = timeit(view_scroll_frame, view, repeat=repeat)
+    relayout = timeit(grid_relayout, layout.GridLayout(11, 20), sprites, sizes, repeat=repeat)
+    print('%d posts' % count)
+    print('legacy update    %9.3f ms/frame' % (legacy * 1000))
+    print('grid update      %9.3f ms/frame (idle)' % (frame * 1000))
+    print('grid update      %9.3f ms/frame (layout dirty, %d sprites placed)' % (dirty * 1000, placed))
+    print('grid update      %9.3f ms/frame (scrolling)' % (scrolled * 1000))
+    print('grid relayout    %9.3f ms (page load, image arrival batch, zoom)' % (relayout * 1000))
+    for browsed in (50, 5000, 50000):
+        grid = layout.GridLayout(11, 20)
+        grid.build(cells(browsed))
+        scroll = timeit(scroll_frames, grid, 1080, 100, repeat=repeat // 10 or 1) / 100
+        print('scroll %6d      %9.3f ms/frame, %d cells live' % (browsed, scroll * 1000, scroll_frames(grid, 1080, 1)))
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,192 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from functools import lru_cache
+from collections import deque
+import threading
+import argparse
+import hashlib
+import random
+import json
+import time
+
+TOP_ID = 3000000
+VARIANTS = {
+    'file':    (50000, 2000000),
+    'sample':  (40000, 250000),
+    'preview': (4000, 20000),
+}
+
+@lru_cache(maxsize=65536)
+def media_size(post_id, variant):
+    low, high = VARIANTS[variant]
+    return random.Random(post_id * 3 + len(variant)).randrange(low, high)
+
+def media_body(post_id, variant):
+    return random.Random(post_id * 7 + len(variant)).randbytes(media_size(post_id, variant))
+
+@lru_cache(maxsize=65536)
+def media_md5(post_id):
+    return hashlib.md5(media_body(post_id, 'file')).hexdigest()
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0, bandwidth=None, error_rate=0, throttle=None, media_url=None, seed=0, drop_rate=0):
+        super().__init__(('127.0.0.1', port), StubHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.throttle = throttle
+        self.drop_rate = drop_rate
+        self.media_url = media_url or self.url
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.served = 0
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_port
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='StubServer', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def throttled(self):
+        if self.throttle == None:
+            return False
+        with self.lock:
+            now = time.perf_counter()
+            while len(self.recent) > 0 and now - self.recent[0] > 1:
+                self.recent.popleft()
+            if len(self.recent) >= self.throttle:
+                return True
+            self.recent.append(now)
+            return False
+
+    def failed(self):
+        with self.lock:
+            self.served += 1
+            return self.random.random() < self.error_rate
+
+    def dropped(self):
+        with self.lock:
+            return self.random.random() < self.drop_rate
+
+    def post(self, post_id):
+        md5 = media_md5(post_id)
+        path = '%d/%s' % (post_id, md5)
+        rng = random.Random(post_id)
+        return {
+            'id': post_id, 'md5': md5, 'rating': rng.choice('sqe'),
+            'tags': ' '.join('tag_%d' % rng.randrange(5000) for i in range(30)),
+            'score': rng.randrange(-10, 500), 'fav_count': rng.randrange(1000),
+            'author': 'stub', 'creator_id': 1, 'status': 'active', 'source': None, 'sources': [],
+            'artist': ['stub'], 'children': '', 'parent_id': None, 'has_children': False,
+            'has_comments': False, 'has_notes': False, 'locked_tags': None, 'change': post_id,
+            'description': '', 'created_at': {'json_class': 'Time', 's': 1500000000 + post_id, 'n': 0},
+            'file_ext': 'png', 'file_size': media_size(post_id, 'file'), 'width': 1920, 'height': 1080,
+            'file_url': '%s/data/%s.png' % (self.media_url, path),
+            'sample_url': '%s/data/sample/%s.jpg' % (self.media_url, path),
+            'sample_width': 850, 'sample_height': 478,
+            'preview_url': '%s/data/preview/%s.jpg' % (self.media_url, path),
+            'preview_width': 150, 'preview_height': 84,
+        }
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if server.latency > 0:
+            time.sleep(server.latency)
+        if server.throttled():
+            return self.send_body(b'Too Many Requests', 'text/plain', {'Retry-After': '1'}, 429)
+        if server.failed():
+            return self.send_body(b'Internal Server Error', 'text/plain', status=500)
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/post/index.json':
+            self.send_index(query)
+        elif url.path.startswith('/data/'):
+            self.send_media(url.path)
+        else:
+            self.send_body(b'Not Found', 'text/plain', status=404)
+
+    def send_index(self, query):
+        limit = int(query.get('limit', ['75'])[0])
+        page = int(query.get('page', ['1'])[0])
+        if 'before_id' in query:
+            top = int(query['before_id'][0]) - 1
+        else:
+            top = TOP_ID - (page - 1) * limit
+        posts = [self.server.post(post_id) for post_id in range(top, max(top - limit, 0), -1)]
+        body = json.dumps(posts).encode('utf8')
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            return self.send_body(b'', None, {'ETag': etag}, 304)
+        self.send_body(body, 'application/json', {'ETag': etag})
+
+    def send_media(self, path):
+        parts = path.split('/')
+        variant = parts[2] if parts[2] in ('sample', 'preview') else 'file'
+        try: post_id = int(parts[-2])
+        except ValueError:
+            return self.send_body(b'Not Found', 'text/plain', status=404)
+        body = media_body(post_id, variant)
+        span = self.headers.get('Range')
+        if not span == None and span.startswith('bytes='):
+            start, end = span[6:].split('-')
+            start = int(start)
+            end = int(end) if end else len(body) - 1
+            headers = {'Content-Range': 'bytes %d-%d/%d' % (start, end, len(body))}
+            return self.send_body(body[start:end+1], 'application/octet-stream', headers, 206, self.server.dropped())
+        self.send_body(body, 'application/octet-stream', {'Accept-Ranges': 'bytes'}, 200, self.server.dropped())
+
+    def send_body(self, body, content_type, headers={}, status=200, drop=False):
+        self.send_response(status)
+        if not content_type == None:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        bandwidth = self.server.bandwidth
+        chunk = 16384
+        end = len(body) // 2 if drop else len(body)
+        try:
+            for i in range(0, end, chunk):
+                self.wfile.write(body[i:i+chunk])
+                if not bandwidth == None:
+                    time.sleep(min(chunk, len(body) - i) / bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        if drop:
+            self.wfile.flush()
+            self.close_connection = True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the e621 API and media hosts.')
+    parser.add_argument('--port', type=int, default=8621)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added before every response')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes per second per connection')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests answered with 500')
+    parser.add_argument('--throttle', type=int, default=None, help='requests per second before answering 429')
+    parser.add_argument('--drop-rate', type=float, default=0, help='fraction of media responses cut off halfway')
+    parser.add_argument('--media-url', default=None, help='base url used in media links, defaults to this server')
+    args = parser.parse_args()
+    server = StubServer(args.port, args.latency, args.bandwidth, args.error_rate, args.throttle, args.media_url, drop_rate=args.drop_rate)
+    print('Serving on', server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
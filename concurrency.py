@@ -0,0 +1,52 @@
+from collections import deque
+import threading
+import time
+
+class AdaptiveLimit:
+    def __init__(self, initial, minimum, maximum, backoff=0.75, smoothing=0.2, interval=1, history=120):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.interval = interval
+        self.short_latency = None
+        self.long_latency = None
+        self.history = deque(maxlen=history)
+        self.lock = threading.Lock()
+        self._bytes = 0
+        self._period = time.perf_counter()
+
+    def record(self, latency, size=0, ok=True):
+        with self.lock:
+            self._bytes += size
+            if not ok:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+            else:
+                if self.short_latency == None:
+                    self.short_latency = self.long_latency = latency
+                self.short_latency += (latency - self.short_latency) * 0.2
+                self.long_latency += (latency - self.long_latency) * 0.02
+                if self.long_latency > self.short_latency * 2:
+                    self.long_latency = self.short_latency * 2
+                gradient = min(1, max(0.5, self.long_latency / self.short_latency))
+                target = self.limit * gradient + self.limit ** 0.5
+                self.limit += (target - self.limit) * self.smoothing
+                self.limit = min(self.maximum, max(self.minimum, self.limit))
+            self._snapshot()
+
+    def _snapshot(self):
+        now = time.perf_counter()
+        elapsed = now - self._period
+        if elapsed >= self.interval:
+            self.history.append((time.time(), round(self.limit, 2), self._bytes / elapsed, self.short_latency))
+            self._bytes = 0
+            self._period = now
+
+    @property
+    def current(self):
+        return int(self.limit)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.history)
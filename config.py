@@ -3,10 +3,59 @@ BASE_URL = 'https://e621.net'
 
 DOWNLOADS = 'downloads\\'
 METADATA  = DOWNLOADS + 'meta.ini'
+METADATA_DB    = DOWNLOADS + 'meta.db'
+METADATA_BATCH = 50
+BULK_DOWNLOADS = 8
+BULK_PAGE_SIZE = 320
+PROGRESS_INTERVAL = 0.25
+
+CACHE        = 'cache\\'
+SEARCH_CACHE = CACHE + 'search\\'
+SEARCH_TTL   = 300
+SEARCH_SESSION = 32
+MEDIA_CACHE  = CACHE + 'media\\'
+PARTIAL_CACHE = MEDIA_CACHE + 'partial\\'
+MEDIA_CACHE_BYTES = 2147483648
+
+MAX_PAGE       = 750
+PREFETCH_PAGES = 2
+GRID_PAGE_SIZE = 75
+GRID_CELL      = 150
+GRID_PADDING   = 20
+GRID_MARGIN    = 2
+GRID_KEEP_PAGES = 4
+SCROLL_STEP    = 120
 
 RESOURCES        = "res\\"
-TEMP_SUBD_DIR    = '\\E621 DL Cache'
+CONCURRENT_MIN   = 2
+CONCURRENT_START = 6
 CONCURRENT_LIMIT = 30
+HANDLER_THREADS  = 4
+CHUNK_SIZE       = 65536
+DECODE_PROCESSES = 0
+IMAGE_RAM_BYTES  = 536870912
+IMAGE_VRAM_BYTES = 268435456
+ATLAS_SIZE       = 2048
+ATLAS_SLOT       = 154
+ATLAS_PADDING    = 2
+ATLAS_MAX        = 8
+FRAME_RATE       = 60
+UPLOAD_BUDGET    = 4
+VSYNC_ANIMATING  = False
+WRITER_THREADS   = 2
+
+DOWNLOAD_BUFFER  = 1048576
+INFLIGHT_BYTES   = 33554432
+DOWNLOAD_RETRIES = 3
+
+API_RATE    = 2
+API_BURST   = 2
+MEDIA_RATE  = 50
+MEDIA_BURST = 30
+
+METRICS_JSON     = CACHE + 'metrics.json'
+METRICS_PROM     = CACHE + 'metrics.prom'
+METRICS_INTERVAL = 10
 
 ICON_16x16 = RESOURCES + "16x16.png"
 ICON_32x32 = RESOURCES + "32x32.png"
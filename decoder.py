@@ -0,0 +1,198 @@
+from multiprocessing import shared_memory, resource_tracker
+import subprocess
+import threading
+import workers
+import metrics
+import config
+import ctypes
+import queue
+import json
+import sys
+import os
+
+processes = queue.Queue()
+children = []
+pool = None
+start_lock = threading.Lock()
+pixel_buffer = None
+
+class DecodeError(Exception):
+    pass
+
+class Decoded:
+    def __init__(self, process, name, layout):
+        self.process = process
+        self.name = name
+        self.layout = layout
+        self.released = False
+
+    def upload(self):
+        from pyglet import image
+        shm = shared_memory.SharedMemory(self.name)
+        if os.name == 'posix':
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        frames = []
+        try:
+            for width, height, duration, offset in self.layout:
+                texture = image.Texture.create(width, height)
+                pixels = (ctypes.c_ubyte * (width * height * 4)).from_buffer(shm.buf, offset)
+                sub_image(texture, 0, 0, width, height, pixels)
+                del pixels
+                frames.append((texture, duration))
+        finally:
+            shm.close()
+        if len(frames) == 1 and frames[0][1] == None:
+            return frames[0][0]
+        return image.Animation([image.AnimationFrame(texture, duration) for texture, duration in frames])
+
+    def upload_into(self, texture, x, y):
+        width, height, duration, offset = self.layout[0]
+        shm = shared_memory.SharedMemory(self.name)
+        if os.name == 'posix':
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        try:
+            pixels = (ctypes.c_ubyte * (width * height * 4)).from_buffer(shm.buf, offset)
+            sub_image(texture, x, y, width, height, pixels)
+            del pixels
+        finally:
+            shm.close()
+        return texture.get_region(x, y, width, height)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.process.send({'release': self.name})
+
+def pixel_unpack_buffer():
+    global pixel_buffer
+    from pyglet import gl
+    if pixel_buffer == None:
+        pixel_buffer = 0
+        if gl.gl_info.have_version(2, 1) or gl.gl_info.have_extension('GL_ARB_pixel_buffer_object'):
+            buffer = gl.GLuint()
+            gl.glGenBuffers(1, ctypes.byref(buffer))
+            pixel_buffer = buffer.value
+    return pixel_buffer
+
+def sub_image(texture, x, y, width, height, pixels):
+    from pyglet import gl
+    gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 4)
+    gl.glBindTexture(texture.target, texture.id)
+    buffer = pixel_unpack_buffer()
+    if buffer == 0:
+        gl.glTexSubImage2D(texture.target, texture.level, x, y, width, height, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, pixels)
+        return
+    gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, buffer)
+    gl.glBufferData(gl.GL_PIXEL_UNPACK_BUFFER, ctypes.sizeof(pixels), None, gl.GL_STREAM_DRAW)
+    gl.glBufferSubData(gl.GL_PIXEL_UNPACK_BUFFER, 0, ctypes.sizeof(pixels), pixels)
+    gl.glTexSubImage2D(texture.target, texture.level, x, y, width, height, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, None)
+    gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
+
+class DecoderProcess:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+
+    def send(self, message):
+        with self.lock:
+            try:
+                self.process.stdin.write(json.dumps(message) + '\n')
+                self.process.stdin.flush()
+            except (OSError, ValueError):
+                pass
+
+    def decode(self, path, animated):
+        self.send({'path': path, 'animated': animated})
+        reply = self.process.stdout.readline()
+        if reply == '':
+            raise DecodeError('Decoder exited while decoding ' + path)
+        reply = json.loads(reply)
+        if 'error' in reply:
+            raise DecodeError(reply['error'])
+        return Decoded(self, reply['name'], reply['layout'])
+
+    def stop(self):
+        with self.lock:
+            try: self.process.stdin.close()
+            except OSError: pass
+        try: self.process.wait(1)
+        except subprocess.TimeoutExpired:
+            self.process.terminate()
+            self.process.wait()
+
+def start():
+    global pool
+    with start_lock:
+        if pool == None:
+            count = config.DECODE_PROCESSES or os.cpu_count() or 1
+            for i in range(count):
+                children.append(DecoderProcess())
+                processes.put(children[-1])
+            pool = workers.WorkerPool(count, 'Decoder')
+
+def decode(path, animated):
+    process = processes.get()
+    try:
+        if not process.process.poll() == None:
+            children.remove(process)
+            process = DecoderProcess()
+            children.append(process)
+        return metrics.timed('decode', process.decode, path, animated)
+    finally:
+        processes.put(process)
+
+def submit(path, animated=False):
+    start()
+    return pool.submit(decode, path, animated)
+
+def stop():
+    global pool
+    with start_lock:
+        if not pool == None:
+            pool.stop()
+            for process in children:
+                process.stop()
+            pool.join()
+            children.clear()
+            pool = None
+
+def serve():
+    import pyglet
+    pyglet.options['shadow_window'] = False
+    from pyglet import image
+    segments = dict()
+    for line in sys.stdin:
+        message = json.loads(line)
+        if 'release' in message:
+            shm = segments.pop(message['release'], None)
+            if not shm == None:
+                shm.close()
+                shm.unlink()
+            continue
+        try:
+            if message['animated']:
+                frames = [(frame.image.get_image_data(), frame.duration) for frame in image.load_animation(message['path']).frames]
+            else:
+                frames = [(image.load(message['path']).get_image_data(), None)]
+            shm = shared_memory.SharedMemory(create=True, size=max(sum(data.width * data.height * 4 for data, duration in frames), 1))
+            layout = []
+            offset = 0
+            for data, duration in frames:
+                pixels = data.get_data('RGBA', data.width * 4)
+                shm.buf[offset:offset+len(pixels)] = pixels
+                layout.append((data.width, data.height, duration, offset))
+                offset += len(pixels)
+            segments[shm.name] = shm
+            reply = {'name': shm.name, 'layout': layout}
+        except Exception as e:
+            reply = {'error': '%s: %s' % (message['path'], e)}
+        sys.stdout.write(json.dumps(reply) + '\n')
+        sys.stdout.flush()
+    for shm in segments.values():
+        shm.close()
+        shm.unlink()
+
+metrics.gauge('decoder_queue_depth', lambda: pool.queue.qsize() if not pool == None else 0)
+
+if __name__ == '__main__':
+    serve()
@@ -1,65 +1,183 @@
 import config as prgm_config
-import configparser
-import tools
-import api
-import sys
+import threading
+import metastore
+import progress
+import shutil
+import engine
+import json
 import os
 
-if not os.path.exists(prgm_config.METADATA):
-    open(prgm_config.METADATA, 'a').close()
-
-def load_parser():
-    config = configparser.ConfigParser()
-    with open(prgm_config.METADATA, encoding='utf8') as src_file:
-        config.read_file(src_file)
-    return config
-
-def save_parser(config):
-    with open(prgm_config.METADATA, 'w', encoding='utf8') as tgt_file:
-        config.write(tgt_file)
-
 def download_posts(posts, tgt_dir=prgm_config.DOWNLOADS):
-    config = load_parser()
-    for post in posts:
-        download_post(config, post, tgt_dir)
-    save_parser(config)
+    rows = []
+    try:
+        for post in posts:
+            row = download_post(post, tgt_dir)
+            if not row == None:
+                rows.append(row)
+            if len(rows) >= prgm_config.METADATA_BATCH:
+                metastore.add_many(rows)
+                rows = []
+    finally:
+        metastore.add_many(rows)
 
-def download_post(config, post, tgt_dir):
+def download_post(post, tgt_dir):
     if not os.path.exists(tgt_dir):
-        os.mkdir(tgt_dir)
-    if str(post.id) in config.sections():
+        os.makedirs(tgt_dir)
+    if metastore.contains(post.id):
         print('Skipped post \''+str(post.id)+'\'; Already in repository.')
-        return
+        return None
     tgt_dir += str(post.id) + '.' + post.file_ext
-    config[post.id] = dict(post.reduce_data())
-    config[post.id]['file_path'] = tgt_dir
     with open(tgt_dir, 'w') as outfile:
         download_file(post.file_url, outfile)
+    return metastore.row(post, tgt_dir)
 
 def download_file(url, tgt_fd):
-    from time import sleep
-    print('Fuck you bitch, download it yourself...')
-    sleep(5)
-    print('Well fuck, if you insist...')
+    outfile = tgt_fd.buffer if hasattr(tgt_fd, 'buffer') else tgt_fd
+    response = engine.stream(url, priority=engine.PRIORITY_FILE)
+    size = response.headers.get('Content-Length')
+    transfer = progress.start(url, int(size) if not size == None else None)
+    buffer = bytearray(prgm_config.DOWNLOAD_BUFFER)
+    view = memoryview(buffer)
+    try:
+        while True:
+            read = response.readinto(buffer)
+            if read == 0:
+                break
+            outfile.write(view[:read])
+            transfer.update(read)
+        outfile.flush()
+    finally:
+        response.close()
+        transfer.finish()
+
+class BulkDownload:
+    def __init__(self, posts=None, tags=None, tgt_dir=prgm_config.DOWNLOADS, token=None):
+        self.tgt_dir = tgt_dir
+        self.token = token or engine.CancelToken()
+        self.slots = threading.BoundedSemaphore(prgm_config.BULK_DOWNLOADS)
+        self.lock = threading.Condition()
+        self.active = 0
+        self.library = dict()
+        self.completed = []
+        self.transfers = dict()
+        self.results = { 'downloaded': 0, 'linked': 0, 'failed': 0 }
+        if not tags == None:
+            import pager
+            search_pager = pager.Pager(tags, prgm_config.BULK_PAGE_SIZE)
+            try: self.enqueue(post for page in search_pager for post in page)
+            finally: search_pager.close()
+        if not posts == None:
+            self.enqueue(posts)
+
+    def enqueue(self, posts):
+        if not os.path.exists(self.tgt_dir):
+            os.makedirs(self.tgt_dir)
+        rows = []
+        for post in posts:
+            if post.file_url == None:
+                continue
+            rows.append(metastore.pending_row(post, self.tgt_dir + str(post.id) + '.' + post.file_ext))
+            if len(rows) >= prgm_config.METADATA_BATCH:
+                metastore.enqueue(rows)
+                rows = []
+        metastore.enqueue(rows)
+
+    def run(self):
+        for post_id, md5, file_url, file_path, data in metastore.pending():
+            if self.token.cancelled:
+                break
+            self.slots.acquire()
+            with self.lock:
+                self.active += 1
+            row = (post_id, md5, file_path, data)
+            transfer = self.transfers[post_id] = progress.start(file_url, json.loads(data).get('file_size'))
+            if not self.link(row):
+                engine.submit(file_url, response_handler=lambda response, row=row: self.finish(row, response),
+                              error_handler=lambda e, row=row: self.fail(row, e), priority=engine.PRIORITY_FILE,
+                              token=self.token, to_file=True, progress=transfer.update)
+        with self.lock:
+            self.lock.wait_for(lambda: self.active == 0)
+            self.flush(0)
+        return self.results
+
+    def link(self, row, response=None):
+        post_id, md5, file_path, data = row
+        with self.lock:
+            source = self.library.get(md5) or metastore.find_md5(md5)
+            if source == None:
+                return False
+            if not os.path.abspath(source) == os.path.abspath(file_path):
+                try: os.link(source, file_path)
+                except FileExistsError:
+                    os.remove(file_path)
+                    os.link(source, file_path)
+                except OSError:
+                    shutil.copyfile(source, file_path)
+            self.results['linked'] += 1
+            if not response == None:
+                response.discard()
+            self.done(row)
+            return True
+
+    def finish(self, row, response):
+        post_id, md5, file_path, data = row
+        try:
+            if self.link(row, response):
+                return
+            if not md5 == None and not response.md5() == md5:
+                raise ValueError('md5 mismatch for post ' + str(post_id))
+            with self.lock:
+                if self.link(row, response):
+                    return
+                response.move(file_path)
+                if not md5 == None:
+                    self.library[md5] = file_path
+                self.results['downloaded'] += 1
+                self.done(row)
+        except Exception as e:
+            response.discard()
+            self.fail(row, e)
+        finally:
+            response.discard()
+
+    def fail(self, row, e):
+        print('Failed to download post', row[0], '-', e)
+        with self.lock:
+            self.results['failed'] += 1
+            self.release(row)
+
+    def done(self, row):
+        self.completed.append(row)
+        self.flush(prgm_config.METADATA_BATCH)
+        self.release(row)
+
+    def flush(self, threshold):
+        if len(self.completed) > threshold:
+            metastore.complete(self.completed)
+            self.completed = []
+
+    def release(self, row):
+        self.transfers.pop(row[0]).finish()
+        self.active -= 1
+        self.slots.release()
+        self.lock.notify_all()
 
-    outfile = tgt_fd.buffer
+def bulk_download(posts=None, tags=None, tgt_dir=prgm_config.DOWNLOADS, token=None):
+    return BulkDownload(posts, tags, tgt_dir, token).run()
 
-    print('Requesting \''+url+'\'')
-    response = api.request(url)
-    size = len(response.content)
+def resume_downloads(tgt_dir=prgm_config.DOWNLOADS, token=None):
+    return BulkDownload(None, None, tgt_dir, token).run()
 
-    strlen = 0
-    progress = 0
-    for data in response.iter_content(chunk_size=4096):
-        if data:
-            outfile.write(data)
-            outfile.flush()
-            progress += len(data)
-            g = tools.gauge(progress / size, 20, format='\r    Downloading... [%s]')
-            s = g + ' ' + tools.format_data(progress, 2) + ' / ' + tools.format_data(size, 2)
-            s += ' ' * (strlen - len(s))
-            strlen = len(s)
-            sys.stdout.write(s)
-            sys.stdout.flush()
-    sys.stdout.write('\n')
-    sys.stdout.flush()
\ No newline at end of file
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Download every post matching a search into the library.')
+    parser.add_argument('tags', nargs='?', default=None, help='search query, omit to only resume unfinished downloads')
+    parser.add_argument('--target', default=prgm_config.DOWNLOADS, help='directory to download into')
+    args = parser.parse_args()
+    try:
+        if args.tags == None:
+            print(resume_downloads(args.target))
+        else:
+            print(bulk_download(tags=args.tags, tgt_dir=args.target))
+    finally:
+        engine.stop()
@@ -0,0 +1,556 @@
+from concurrent.futures import Future
+import itertools
+import threading
+import hashlib
+import tempfile
+import shutil
+import concurrency
+import ratelimit
+import workers
+import metrics
+import asyncio
+import aiohttp
+import config
+import queue
+import json
+import time
+import os
+
+loop = None
+session = None
+jobs = None
+handler_pool = None
+writer_pool = None
+byte_budget = None
+loop_thread = None
+active_workers = 0
+controller = concurrency.AdaptiveLimit(config.CONCURRENT_START, config.CONCURRENT_MIN, config.CONCURRENT_LIMIT)
+start_lock = threading.Lock()
+sequence = itertools.count()
+flights = dict()
+
+PRIORITY_VISIBLE  = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_FILE     = 2
+
+class Cancelled(Exception):
+    pass
+
+class CancelToken:
+    def __init__(self):
+        self.cancelled = False
+        self.flights = set()
+
+    def cancel(self):
+        self.cancelled = True
+        if not loop == None:
+            loop.call_soon_threadsafe(self.cancel_flights)
+
+    def cancel_flights(self):
+        for flight in list(self.flights):
+            flight.detach(self)
+        self.flights.clear()
+
+class HTTPError(Exception):
+    def __init__(self, response):
+        super().__init__('%s %s for url: %s' % (response.status_code, response.reason, response.url))
+        self.response = response
+
+class Response:
+    def __init__(self, url, status_code, reason, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf8', 'replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i+chunk_size]
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HTTPError(self)
+
+class StreamResponse:
+    def __init__(self, url, status_code, reason, headers, chunks):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.chunks = chunks
+        self.flight = None
+        self.pending = None
+
+    def readinto(self, buffer):
+        view = memoryview(buffer)
+        filled = 0
+        while filled < len(view):
+            if self.pending == None:
+                chunk = self.chunks.get()
+                if chunk == None:
+                    self.chunks.put_nowait(None)
+                    break
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                self.pending = memoryview(chunk)
+            size = min(len(self.pending), len(view) - filled)
+            view[filled:filled+size] = self.pending[:size]
+            filled += size
+            self.pending = self.pending[size:] if size < len(self.pending) else None
+        return filled
+
+    def iter_content(self, chunk_size=None):
+        while True:
+            chunk = self.chunks.get()
+            if chunk == None:
+                return
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+
+    def json(self):
+        return json.loads(b''.join(self.iter_content()))
+
+    def close(self):
+        if not self.flight == None and not loop == None:
+            loop.call_soon_threadsafe(self.flight.abort)
+
+class FileResponse:
+    def __init__(self, url, status_code, reason, headers, path, size):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.path = path
+        self.size = size
+        self._save_lock = threading.RLock()
+        self._saved = False
+        self._holders = 0
+        self._md5 = None
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def content(self):
+        with open(self.path, 'rb') as src_file:
+            return src_file.read()
+
+    def iter_content(self, chunk_size=1):
+        with open(self.path, 'rb') as src_file:
+            while True:
+                data = src_file.read(chunk_size)
+                if not data:
+                    return
+                yield data
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HTTPError(self)
+
+    def md5(self):
+        with self._save_lock:
+            if self._md5 == None:
+                digest = hashlib.md5()
+                with open(self.path, 'rb') as src_file:
+                    for block in iter(lambda: src_file.read(config.DOWNLOAD_BUFFER), b''):
+                        digest.update(block)
+                self._md5 = digest.hexdigest()
+            return self._md5
+
+    def move(self, path):
+        with self._save_lock:
+            if not self._saved:
+                shutil.move(self.path, path)
+                self.path = path
+                self._saved = True
+
+    def hold(self, count):
+        with self._save_lock:
+            self._holders += count
+
+    def release(self):
+        with self._save_lock:
+            self._holders -= 1
+            if self._holders <= 0:
+                self.discard()
+
+    def discard(self):
+        with self._save_lock:
+            if not self._saved:
+                self._saved = True
+                try: os.remove(self.path)
+                except OSError: pass
+            return self.path
+
+class ByteBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, size):
+        size = min(size, self.limit)
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.used + size <= self.limit)
+            self.used += size
+        return size
+
+    async def release(self, size):
+        async with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+class Flight:
+    def __init__(self, key, url, params, headers, priority):
+        self.key = key
+        self.url = url
+        self.params = params
+        self.headers = headers
+        self.priority = priority
+        self.waiters = []
+        self.task = None
+        self.detached = False
+        self.observers = []
+        self.created = time.perf_counter()
+
+    def attach(self, response_handler, error_handler, token, inline=False):
+        self.waiters.append((response_handler, error_handler, token, inline))
+        if not token == None:
+            token.flights.add(self)
+
+    def detach(self, token):
+        for waiter in [w for w in self.waiters if w[2] is token]:
+            self.waiters.remove(waiter)
+            handler_pool.submit(waiter[1], Cancelled(self.url))
+        if len(self.waiters) == 0:
+            if flights.get(self.key) is self:
+                del flights[self.key]
+            if not self.task == None:
+                self.detached = True
+                self.task.cancel()
+
+    def abort(self):
+        if not self.task == None and not self.task.done():
+            self.detached = True
+            self.task.cancel()
+
+    def resolve(self, response=None, error=None):
+        if flights.get(self.key) is self:
+            del flights[self.key]
+        for response_handler, error_handler, token, inline in self.waiters:
+            if not token == None:
+                token.flights.discard(self)
+            handler = response_handler if error == None else error_handler
+            if inline:
+                handler(response if error == None else error)
+            else:
+                handler_pool.submit(handler, response if error == None else error)
+        self.waiters.clear()
+
+    async def run(self):
+        response = await fetch(self.url, self.params, self.headers)
+        response.raise_for_status()
+        self.resolve(response)
+
+class StreamFlight(Flight):
+    async def run(self):
+        started = await begin(self.url)
+        size = 0
+        chunks = queue.Queue()
+        try:
+            async with session.get(self.url, params=self.params, headers=self.headers) as response:
+                latency = time.perf_counter() - started
+                if response.status >= 400:
+                    content = await response.read()
+                    record(response.status, started, latency, len(content))
+                    raise HTTPError(Response(str(response.url), response.status, response.reason, response.headers, content))
+                stream = StreamResponse(str(response.url), response.status, response.reason, response.headers, chunks)
+                stream.flight = self
+                self.resolve(stream)
+                async for chunk in response.content.iter_chunked(config.CHUNK_SIZE):
+                    chunks.put_nowait(chunk)
+                    size += len(chunk)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            record_failure(started)
+            chunks.put_nowait(e)
+            raise
+        except asyncio.CancelledError:
+            chunks.put_nowait(Cancelled(self.url))
+            raise
+        finally:
+            chunks.put_nowait(None)
+        record(response.status, started, latency, size)
+
+class FileFlight(Flight):
+    def resolve(self, response=None, error=None):
+        if not response == None:
+            response.hold(len(self.waiters))
+            if len(self.waiters) == 0:
+                response.discard()
+            self.waiters = [(releasing(response_handler, response), error_handler, token, inline)
+                            for response_handler, error_handler, token, inline in self.waiters]
+        super().resolve(response, error)
+
+    async def run(self):
+        if not os.path.exists(config.PARTIAL_CACHE):
+            os.makedirs(config.PARTIAL_CACHE)
+        fd, path = tempfile.mkstemp('.part', 'e621dl', config.PARTIAL_CACHE)
+        outfile = os.fdopen(fd, 'wb')
+        try:
+            response, size = await self.download(outfile)
+        except BaseException:
+            outfile.close()
+            os.remove(path)
+            raise
+        outfile.close()
+        self.resolve(FileResponse(str(response.url), response.status, response.reason, response.headers, path, size))
+
+    def report(self, amount):
+        for observer in self.observers:
+            observer(amount)
+
+    async def download(self, outfile):
+        written = 0
+        attempts = 0
+        validator = None
+        while True:
+            headers = dict(self.headers)
+            if written > 0:
+                headers['Range'] = 'bytes=%d-' % written
+                if not validator == None:
+                    headers['If-Range'] = validator
+            started = await begin(self.url)
+            try:
+                async with session.get(self.url, params=self.params, headers=headers) as response:
+                    latency = time.perf_counter() - started
+                    if response.status >= 400:
+                        content = await response.read()
+                        record(response.status, started, latency, len(content))
+                        raise HTTPError(Response(str(response.url), response.status, response.reason, response.headers, content))
+                    if written > 0 and not response.status == 206:
+                        await write_block(outfile.truncate, 0)
+                        await write_block(outfile.seek, 0)
+                        self.report(-written)
+                        written = 0
+                    validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+                    received = written
+                    while True:
+                        credit = await byte_budget.acquire(config.DOWNLOAD_BUFFER)
+                        try:
+                            block = bytearray()
+                            while len(block) < credit:
+                                chunk = await response.content.read(min(config.CHUNK_SIZE, credit - len(block)))
+                                if not chunk:
+                                    break
+                                block += chunk
+                                received += len(chunk)
+                            if len(block) > 0:
+                                await write_block(outfile.write, block)
+                                written += len(block)
+                                self.report(len(block))
+                        finally:
+                            await byte_budget.release(credit)
+                        if len(block) == 0 or response.content.at_eof():
+                            break
+            except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                record_failure(started)
+                metrics.inc('download_retries')
+                attempts += 1
+                if attempts > config.DOWNLOAD_RETRIES:
+                    raise
+                continue
+            record(response.status, started, latency, received)
+            if written > 0:
+                await write_block(outfile.flush)
+            return response, written
+
+def releasing(handler, response):
+    def wrapper(value):
+        try:
+            handler(value)
+        finally:
+            response.release()
+    return wrapper
+
+async def write_block(func, *args):
+    return await asyncio.wrap_future(writer_pool.submit(metrics.timed, 'disk_write', func, *args))
+
+def start():
+    global loop, handler_pool, writer_pool, loop_thread
+    with start_lock:
+        if loop == None:
+            loop = asyncio.new_event_loop()
+            handler_pool = workers.WorkerPool(config.HANDLER_THREADS, 'Handler')
+            writer_pool = workers.WorkerPool(config.WRITER_THREADS, 'Writer')
+            ready = threading.Event()
+            loop_thread = threading.Thread(target=run_loop, name='Engine', args=(ready,), daemon=True)
+            loop_thread.start()
+            ready.wait()
+    return loop
+
+def run_loop(ready):
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(open_session())
+    ready.set()
+    loop.run_forever()
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.run_until_complete(session.close())
+    loop.close()
+
+async def open_session():
+    global session, jobs, byte_budget
+    jobs = asyncio.PriorityQueue()
+    byte_budget = ByteBudget(config.INFLIGHT_BYTES)
+    session = aiohttp.ClientSession(
+        headers = {'User-Agent': config.USER_AGENT},
+        connector = aiohttp.TCPConnector(limit=config.CONCURRENT_LIMIT)
+    )
+
+def stop():
+    global loop
+    with start_lock:
+        if loop == None:
+            return
+        loop.call_soon_threadsafe(cancel_flights)
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+        handler_pool.shutdown()
+        writer_pool.shutdown()
+        flights.clear()
+        loop = None
+
+def cancel_flights():
+    for flight in list(flights.values()):
+        flight.resolve(error=Cancelled(flight.url))
+
+def flight_key(url, params, headers):
+    if isinstance(params, dict):
+        params = params.items()
+    return (url, tuple(sorted((str(k), str(v)) for k, v in params)), tuple(sorted(headers.items())))
+
+async def begin(url):
+    await ratelimit.for_url(url).wait()
+    return time.perf_counter()
+
+def record(status, started, latency, size):
+    controller.record(latency, size, not status in (429, 503))
+    metrics.observe('ttfb', latency)
+    metrics.observe('transfer', time.perf_counter() - started - latency)
+    metrics.inc('bytes_received', size)
+
+def record_failure(started):
+    controller.record(time.perf_counter() - started, ok=False)
+
+async def fetch(url, params={}, headers={}):
+    started = await begin(url)
+    try:
+        async with session.get(url, params=params, headers=headers) as response:
+            latency = time.perf_counter() - started
+            content = await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        record_failure(started)
+        raise
+    record(response.status, started, latency, len(content))
+    return Response(str(response.url), response.status, response.reason, response.headers, content)
+
+def spawn_workers():
+    global active_workers
+    while active_workers < controller.current and active_workers < jobs.qsize():
+        active_workers += 1
+        loop.create_task(worker())
+
+async def worker():
+    global active_workers
+    try:
+        while not jobs.empty() and active_workers <= controller.current:
+            priority, seq, flight = jobs.get_nowait()
+            if flight.task == None and len(flight.waiters) > 0:
+                flight.task = loop.create_task(flight.run())
+                metrics.observe('queue_wait', time.perf_counter() - flight.created)
+                metrics.inc('fetches')
+                try:
+                    await flight.task
+                except asyncio.CancelledError:
+                    if not flight.detached:
+                        raise
+                except Exception as e:
+                    flight.resolve(error=e)
+            jobs.task_done()
+            spawn_workers()
+    finally:
+        active_workers -= 1
+
+def enqueue(url, params, headers, response_handler, error_handler, priority, token, inline=False, kind=Flight, progress=None):
+    metrics.inc('requests')
+    if not token == None and token.cancelled:
+        handler_pool.submit(error_handler, Cancelled(url))
+        return
+    if kind is StreamFlight:
+        key = ('stream', next(sequence))
+    else:
+        key = (kind.__name__,) + flight_key(url, params, headers)
+    flight = flights.get(key)
+    if flight == None:
+        flight = flights[key] = kind(key, url, params, headers, priority)
+        jobs.put_nowait((priority, next(sequence), flight))
+    else:
+        metrics.inc('coalesced')
+        if priority < flight.priority and flight.task == None:
+            flight.priority = priority
+            jobs.put_nowait((priority, next(sequence), flight))
+    flight.attach(response_handler, error_handler, token, inline)
+    if not progress == None:
+        flight.observers.append(progress)
+    spawn_workers()
+
+def submit(url, params={}, response_handler=lambda x:None, error_handler=lambda x:None, priority=PRIORITY_FILE, token=None, to_file=False, progress=None):
+    start()
+    kind = FileFlight if to_file else Flight
+    loop.call_soon_threadsafe(enqueue, url, params, {}, response_handler, error_handler, priority, token, False, kind, progress)
+
+def check_blocking(name):
+    if not loop_thread == None and threading.current_thread() is loop_thread:
+        raise RuntimeError('engine.' + name + ' would block the engine loop; use submit() from loop callbacks')
+
+def request(url, params={}, headers={}, priority=PRIORITY_VISIBLE):
+    check_blocking('request')
+    future = Future()
+    start()
+    loop.call_soon_threadsafe(enqueue, url, params, headers, future.set_result, future.set_exception, priority, None, True)
+    return future.result()
+
+def stream(url, params={}, headers={}, priority=PRIORITY_VISIBLE):
+    check_blocking('stream')
+    future = Future()
+    start()
+    loop.call_soon_threadsafe(enqueue, url, params, headers, future.set_result, future.set_exception, priority, None, True, StreamFlight)
+    return future.result()
+
+def dispatch(handler, *args):
+    start()
+    return handler_pool.submit(handler, *args)
+
+metrics.gauge('engine_queue_depth', lambda: jobs.qsize() if not jobs == None else 0)
+metrics.gauge('engine_workers', lambda: active_workers)
+metrics.gauge('engine_concurrency', lambda: controller.current)
+metrics.gauge('engine_flights', lambda: len(flights))
+metrics.gauge('engine_inflight_bytes', lambda: byte_budget.used if not byte_budget == None else 0)
+metrics.gauge('handler_queue_depth', lambda: handler_pool.queue.qsize() if not handler_pool == None else 0)
+metrics.gauge('writer_queue_depth', lambda: writer_pool.queue.qsize() if not writer_pool == None else 0)
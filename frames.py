@@ -0,0 +1,44 @@
+import metrics
+import config
+import tools
+import time
+
+import pyglet
+
+class Scheduler(pyglet.event.EventDispatcher):
+    def __init__(self, window, update, rate=config.FRAME_RATE, vsync_animating=config.VSYNC_ANIMATING):
+        super().__init__()
+        self.window = window
+        self.update = update
+        self.interval = 1 / rate if rate else 0
+        self.vsync_animating = vsync_animating
+        self.scheduled = False
+        self.last = 0
+        if vsync_animating:
+            window.set_vsync(False)
+
+    def request(self):
+        if self.scheduled:
+            return
+        self.scheduled = True
+        pyglet.clock.schedule_once(self.tick, max(self.last + self.interval - time.perf_counter(), 0))
+
+    def wake(self):
+        pyglet.app.platform_event_loop.post_event(self, 'on_wake')
+
+    def on_wake(self):
+        self.request()
+
+    def tick(self, dt):
+        self.scheduled = False
+        self.last = time.perf_counter()
+        metrics.inc('frames')
+        animating = tools.transitioning()
+        if self.update(dt) or tools.transitioning():
+            animating = True
+        if self.vsync_animating and not animating == self.window.vsync:
+            self.window.set_vsync(animating)
+        if animating:
+            self.request()
+
+Scheduler.register_event_type('on_wake')
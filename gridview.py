@@ -0,0 +1,267 @@
+import imagecache
+import mediacache
+import decoder
+import metrics
+import engine
+import config
+import layout
+import tools
+import threading
+import bisect
+import array
+import queue
+import time
+import os
+
+RANK = dict((variant, rank) for rank, variant in enumerate(mediacache.VARIANTS))
+
+class GridView:
+    def __init__(self, translate, new_sprite, wake, restore, retain, extend):
+        self.translate = translate
+        self.new_sprite = new_sprite
+        self.wake = wake
+        self.restore = restore
+        self.retain = retain
+        self.extend = extend
+        self.lock = threading.Condition(threading.Lock())
+        self.grid = layout.GridLayout(11, config.GRID_PADDING, config.GRID_CELL)
+        self.layout_dirty = False
+        self.posts = list()
+        self.post_index = dict()
+        self.preview_sizes = array.array('H')
+        self.page_starts = list()
+        self.materialized = set()
+        self.restoring = set()
+        self.tokens = dict()
+        self.visible = range(0)
+        self.scroll = -config.GRID_PADDING
+        self.dimensions = (0, 0)
+        self.images = queue.Queue()
+        self.uploads = dict()
+        self.zoom = 1
+        self.focused = None
+        self.shown = dict()
+        self.sprites = dict()
+        self.sprite_pool = list()
+
+    def image_handler(self, token):
+        def file_handler(x):
+            post, file, variant = x
+            if token.cancelled:
+                return
+            animated = 'animated' in post.tags.split(' ') and os.path.splitext(file)[1] == '.gif'
+            decoder.submit(file, animated).add_done_callback(lambda future: self.arrived((post, variant, future)))
+        return file_handler
+
+    def arrived(self, item):
+        self.images.put_nowait(item)
+        self.wake()
+
+    def cell_size(self, index):
+        return (self.preview_sizes[2 * index] * self.zoom, self.preview_sizes[2 * index + 1] * self.zoom)
+
+    def page_of(self, index):
+        return bisect.bisect_right(self.page_starts, index)
+
+    def page_range(self, page):
+        return range(self.page_starts[page - 1], self.page_starts[page] if page < len(self.page_starts) else len(self.posts))
+
+    def invalidate(self):
+        self.layout_dirty = True
+
+    def place_sprite(self, index):
+        sprite = self.sprites[index]
+        post = self.posts[index]
+        image_width = sprite.width / sprite.scale
+        image_height = sprite.height / sprite.scale
+        if post is self.focused:
+            sprite.scale = min(self.dimensions[0] / image_width, self.dimensions[1] / image_height)
+            sprite.x = -sprite.width/2
+            sprite.y = -self.scroll - self.dimensions[1]/2 - sprite.height/2
+        else:
+            cell_width, cell_height = self.cell_size(index)
+            sprite.scale = min(cell_width / image_width, cell_height / image_height)
+            sprite.x, sprite.y = self.grid.place(index, sprite.width, sprite.height)
+
+    def show_image(self, index, image):
+        sprite = self.sprites.get(index)
+        if sprite == None:
+            if len(self.sprite_pool) > 0:
+                sprite = self.sprite_pool.pop()
+                sprite.image = image
+                sprite.visible = True
+            else:
+                sprite = self.new_sprite(image)
+            self.sprites[index] = sprite
+        else:
+            sprite.image = image
+        self.place_sprite(index)
+
+    def hide(self, index):
+        post = self.posts[index]
+        token = self.tokens.pop(index, None)
+        if not token == None:
+            token.cancel()
+        sprite = self.sprites.pop(index, None)
+        if not sprite == None:
+            sprite.visible = False
+            self.sprite_pool.append(sprite)
+        self.uploads.pop(index, None)
+        if not post == None:
+            self.shown.pop(post.id, None)
+            post.clear_cache()
+            if post is self.focused:
+                self.focused = None
+
+    def load_variant(self, post, width, height):
+        variant = post.variant_for(width, height)
+        if RANK[variant] > self.shown.get(post.id, -1):
+            self.arrived((post, variant, None))
+
+    def upload_images(self, height):
+        started = time.perf_counter()
+        onscreen = self.grid.cells(self.scroll, self.scroll + height)
+        centre = (onscreen.start + onscreen.stop) // 2
+        focus = self.post_index.get(self.focused.id, -1) if not self.focused == None else -1
+        for index in sorted(self.uploads, key=lambda index: (not index == focus, not index in onscreen, abs(index - centre))):
+            post, variant = self.uploads.pop(index)
+            if not index in self.visible or not self.posts[index] is post or RANK[variant] <= self.shown.get(post.id, -1):
+                continue
+            image = imagecache.get((post.id, variant), index)
+            if image == None:
+                post.load(variant, self.image_handler(self.tokens[index]), engine.PRIORITY_VISIBLE, self.tokens[index])
+            else:
+                self.shown[post.id] = RANK[variant]
+                self.show_image(index, image)
+            if time.perf_counter() - started >= config.UPLOAD_BUDGET / 1000:
+                break
+        metrics.observe('upload_frame', time.perf_counter() - started)
+
+    def add_post(self, page, post):
+        if post.id in self.post_index:
+            return
+        if len(self.page_starts) < page:
+            self.page_starts.append(len(self.posts))
+            self.materialized.add(page)
+        if page in self.materialized:
+            self.post_index[post.id] = len(self.posts)
+            self.posts.append(post)
+        else:
+            self.posts.append(None)
+        self.preview_sizes.extend((post.preview_width or 0, post.preview_height or 0))
+        self.grid.extend([self.cell_size(len(self.posts) - 1)])
+        self.invalidate()
+
+    def end_page(self, page):
+        if len(self.page_starts) < page:
+            self.page_starts.append(len(self.posts))
+            self.materialized.add(page)
+        self.invalidate()
+
+    def fill_page(self, page, posts):
+        if not page in self.materialized:
+            self.materialized.add(page)
+            for index, post in zip(self.page_range(page), [post for post in posts if not post.id in self.post_index]):
+                self.posts[index] = post
+                self.post_index[post.id] = index
+        self.invalidate()
+
+    def release_pages(self, cells):
+        first = self.page_of(cells.start) - config.GRID_KEEP_PAGES
+        last = self.page_of(max(cells.stop - 1, 0)) + config.GRID_KEEP_PAGES
+        for page in [page for page in self.materialized if page < first or page > last]:
+            self.materialized.discard(page)
+            for index in self.page_range(page):
+                if not self.posts[index] == None:
+                    self.post_index.pop(self.posts[index].id, None)
+                    self.posts[index] = None
+        self.retain(first, last)
+
+    def relayout(self):
+        anchor = self.grid.cells(self.scroll, self.scroll).start
+        self.grid.column_width = config.GRID_CELL * self.zoom
+        self.grid.columns = self.grid.fit(self.dimensions[0])
+        self.grid.build([self.cell_size(index) for index in range(len(self.posts))])
+        if anchor < self.grid.count:
+            self.scroll = self.grid.row_y[self.grid.cell(anchor)[1]] - config.GRID_PADDING
+        self.invalidate()
+
+    def scroll_by(self, amount):
+        with self.lock:
+            if not self.focused == None:
+                self.focused = None
+                self.invalidate()
+            self.scroll = tools.constrain(self.scroll + amount, -config.GRID_PADDING,
+                                          max(self.grid.height + config.GRID_PADDING - self.dimensions[1], -config.GRID_PADDING))
+
+    def clear(self):
+        for index in self.visible:
+            self.hide(index)
+        self.visible = range(0)
+        self.posts.clear()
+        self.post_index.clear()
+        del self.preview_sizes[:]
+        self.page_starts.clear()
+        self.materialized.clear()
+        self.restoring.clear()
+        self.grid.build([])
+        self.scroll = -config.GRID_PADDING
+        self.invalidate()
+
+    def refresh_view(self, height):
+        cells = self.grid.cells(self.scroll, self.scroll + height, config.GRID_MARGIN)
+        if cells == self.visible and not self.layout_dirty:
+            return
+        for index in self.visible:
+            if not index in cells:
+                self.hide(index)
+        entering = [index for index in cells if not index in self.visible]
+        staying = range(max(cells.start, self.visible.start), min(cells.stop, self.visible.stop))
+        self.visible = cells
+        imagecache.set_visible(cells)
+        for index in entering:
+            self.tokens[index] = engine.CancelToken()
+        if self.layout_dirty:
+            self.layout_dirty = False
+            for index in self.sprites:
+                self.place_sprite(index)
+            for index in staying:
+                if not self.posts[index] == None:
+                    self.load_variant(self.posts[index], *self.cell_size(index))
+        for post in sorted([self.posts[index] for index in entering if not self.posts[index] == None], key=lambda post: post.file_size or 0):
+            self.load_variant(post, *self.cell_size(self.post_index[post.id]))
+        for page in set(self.page_of(index) for index in cells if self.posts[index] == None):
+            if not page in self.restoring:
+                self.restoring.add(page)
+                self.restore(page)
+        if len(cells) > 0:
+            self.release_pages(cells)
+        if self.grid.height < self.scroll + 2 * height:
+            self.extend()
+
+    def update(self, window_x, window_y):
+        width = tools.transition('resize_width', 500, self.dimensions[0], tools.SQRT)
+        height = tools.transition('resize_height', 500, self.dimensions[1], tools.SQRT)
+        x = window_x - tools.transition('move_x', 500, window_x, tools.SQRT)
+        y = window_y - tools.transition('move_y', 500, window_y, tools.SQRT)
+        self.translate.x = width/2 - x
+        self.translate.y = height + tools.transition('scroll', 200, self.scroll, tools.SQRT) + y
+        with self.lock:
+            self.refresh_view(max(height, self.dimensions[1]))
+            while not self.images.empty():
+                post, variant, future = self.images.get_nowait()
+                key = (post.id, variant)
+                index = self.post_index.get(post.id, -1)
+                if not future == None:
+                    try:
+                        imagecache.put(key, future.result(), max(index, 0))
+                    except Exception as e:
+                        print(e)
+                        continue
+                if not index in self.visible or not self.posts[index] is post or RANK[variant] <= self.shown.get(post.id, -1):
+                    continue
+                if not index in self.uploads or RANK[variant] > RANK[self.uploads[index][1]]:
+                    self.uploads[index] = (post, variant)
+            if len(self.uploads) > 0:
+                self.upload_images(max(height, self.dimensions[1]))
+            return len(self.uploads) > 0 or not self.images.empty()
@@ -0,0 +1,135 @@
+from collections import OrderedDict
+import threading
+import metrics
+import atlas
+import config
+
+lock = threading.RLock()
+textures = OrderedDict()
+pixels = OrderedDict()
+usage = {'ram': 0, 'vram': 0}
+stats = {'texture_hits': 0, 'pixel_hits': 0, 'misses': 0, 'uploads': 0, 'texture_evictions': 0, 'pixel_evictions': 0}
+visible = range(0)
+
+def image_size(decoded):
+    return sum(width * height * 4 for width, height, duration, offset in decoded.layout)
+
+def set_visible(cells):
+    global visible
+    with lock:
+        visible = cells
+
+def distance(position):
+    if position in visible:
+        return 0
+    return min(abs(position - visible.start), abs(position - visible.stop + 1))
+
+def get(key, position):
+    with lock:
+        if key in textures:
+            stats['texture_hits'] += 1
+            image, size, old = textures.pop(key)
+            textures[key] = (image, size, position)
+            if key in pixels:
+                pixels[key] = pixels.pop(key)[:2] + (position,)
+            return image
+        if key in pixels:
+            stats['pixel_hits'] += 1
+            decoded, size, old = pixels.pop(key)
+            pixels[key] = (decoded, size, position)
+            stats['uploads'] += 1
+            image = metrics.timed('texture_upload', upload, decoded)
+            put_texture(key, image, size, position)
+            return image
+        stats['misses'] += 1
+        return None
+
+def upload(decoded):
+    image = atlas.upload(decoded)
+    if image == None and atlas.fits(decoded) and reclaim_slot():
+        image = atlas.upload(decoded)
+    if image == None:
+        image = decoded.upload()
+    return image
+
+def reclaim_slot():
+    victim = None
+    farthest = 0
+    for key, (image, size, position) in textures.items():
+        if not getattr(image, 'atlas_slot', None) == None and distance(position) > farthest:
+            victim = key
+            farthest = distance(position)
+    if victim == None:
+        return False
+    image, size, position = textures.pop(victim)
+    usage['vram'] -= size
+    stats['texture_evictions'] += 1
+    free(image)
+    return True
+
+def put(key, decoded, position):
+    with lock:
+        if key in pixels:
+            decoded.release()
+            return
+        size = image_size(decoded)
+        pixels[key] = (decoded, size, position)
+        usage['ram'] += size
+        evict(pixels, 'ram', config.IMAGE_RAM_BYTES, 'pixel_evictions', key)
+
+def put_texture(key, image, size, position):
+    old = textures.pop(key, None)
+    if not old == None:
+        usage['vram'] -= old[1]
+        free(old[0])
+    textures[key] = (image, size, position)
+    usage['vram'] += size
+    evict(textures, 'vram', config.IMAGE_VRAM_BYTES, 'texture_evictions', key)
+
+def evict(entries, tier, limit, counter, keep=None):
+    while usage[tier] > limit:
+        victim = None
+        farthest = 0
+        for key, entry in entries.items():
+            if not key == keep and distance(entry[2]) > farthest:
+                victim = key
+                farthest = distance(entry[2])
+        if victim == None:
+            return
+        value, size, position = entries.pop(victim)
+        usage[tier] -= size
+        stats[counter] += 1
+        if tier == 'ram':
+            value.release()
+        else:
+            free(value)
+
+def free(image):
+    if hasattr(image, 'atlas_slot'):
+        atlas.release(image)
+    elif hasattr(image, 'frames'):
+        for frame in image.frames:
+            frame.image.delete()
+    else:
+        image.delete()
+
+def snapshot():
+    with lock:
+        lookups = stats['texture_hits'] + stats['pixel_hits'] + stats['misses']
+        return dict(stats, textures=len(textures), pixels=len(pixels), ram=usage['ram'], vram=usage['vram'],
+                    hit_rate=(stats['texture_hits'] + stats['pixel_hits']) / lookups if lookups > 0 else 0)
+
+def clear():
+    with lock:
+        for decoded, size, position in pixels.values():
+            decoded.release()
+        pixels.clear()
+        for image, size, position in textures.values():
+            free(image)
+        textures.clear()
+        usage['ram'] = 0
+        usage['vram'] = 0
+
+metrics.gauge('image_cache_hit_rate', lambda: snapshot()['hit_rate'])
+metrics.gauge('image_cache_ram_bytes', lambda: usage['ram'])
+metrics.gauge('image_cache_vram_bytes', lambda: usage['vram'])
@@ -0,0 +1,39 @@
+import codecs
+import json
+
+decoder = json.JSONDecoder()
+WHITESPACE = ' \t\n\r'
+
+def iter_array(chunks):
+    text_decoder = codecs.getincrementaldecoder('utf8')()
+    buffer = ''
+    pos = 0
+    started = False
+    for chunk in chunks:
+        buffer = buffer[pos:] + text_decoder.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in WHITESPACE:
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if not buffer[pos] == '[':
+                    raise ValueError('Expected a JSON array')
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            if buffer[pos] == ',':
+                pos += 1
+                continue
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                break
+            if end == len(buffer) and not isinstance(value, (dict, list)):
+                break
+            pos = end
+            yield value
+    raise ValueError('Truncated JSON array')
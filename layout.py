@@ -0,0 +1,45 @@
+import bisect
+
+class GridLayout:
+    def __init__(self, columns=11, padding=20, column_width=150):
+        self.columns = columns
+        self.padding = padding
+        self.column_width = column_width
+        self.build([])
+
+    def build(self, sizes):
+        self.count = 0
+        self.row_y = []
+        self.row_height = []
+        self.height = 0
+        self.extend(sizes)
+
+    def extend(self, sizes):
+        for width, height in sizes:
+            column, row = self.cell(self.count)
+            if column == 0:
+                self.row_y.append(self.height + self.padding if row > 0 else 0)
+                self.row_height.append(0)
+            self.row_height[row] = max(self.row_height[row], height)
+            self.height = self.row_y[row] + self.row_height[row]
+            self.count += 1
+
+    def fit(self, width):
+        return max(int((width + self.padding) // (self.column_width + self.padding)), 1)
+
+    def width(self):
+        return self.columns * (self.column_width + self.padding) - self.padding
+
+    def cell(self, index):
+        return (index % self.columns, index // self.columns)
+
+    def cells(self, top, bottom, margin=0):
+        first = max(bisect.bisect_right(self.row_y, top) - 1 - margin, 0)
+        last = min(bisect.bisect_right(self.row_y, bottom) + margin, len(self.row_y))
+        return range(min(first * self.columns, self.count), min(last * self.columns, self.count))
+
+    def place(self, index, width, height):
+        column, row = self.cell(index)
+        x = column * (self.column_width + self.padding) - self.width() / 2 + (self.column_width - width) / 2
+        y = -self.row_y[row] - (self.row_height[row] + height) / 2
+        return (x, y)
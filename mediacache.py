@@ -0,0 +1,108 @@
+from collections import OrderedDict
+import threading
+import sqlite3
+import shutil
+import metrics
+import config
+import time
+import os
+
+VARIANTS = ('preview', 'sample', 'file')
+
+lock = threading.RLock()
+entries = OrderedDict()
+total_size = 0
+connection = None
+
+def open_index():
+    global connection, total_size
+    with lock:
+        if not connection == None:
+            return
+        if not os.path.exists(config.MEDIA_CACHE):
+            os.makedirs(config.MEDIA_CACHE)
+        connection = sqlite3.connect(config.MEDIA_CACHE + 'index.db', check_same_thread=False, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS entries (variant TEXT, md5 TEXT, ext TEXT, size INTEGER, accessed REAL, PRIMARY KEY (variant, md5))')
+        missing = []
+        for variant, md5, ext, size, accessed in connection.execute('SELECT * FROM entries ORDER BY accessed'):
+            if os.path.exists(path_for(variant, md5, ext)):
+                entries[(variant, md5)] = (ext, size)
+                total_size += size
+            else:
+                missing.append((variant, md5))
+        connection.executemany('DELETE FROM entries WHERE variant=? AND md5=?', missing)
+
+def path_for(variant, md5, ext):
+    return os.path.join(config.MEDIA_CACHE, variant, md5[:2], md5 + '.' + ext)
+
+def lookup(variant, md5):
+    open_index()
+    with lock:
+        entry = entries.get((variant, md5))
+        if entry == None:
+            metrics.inc('media_cache_misses')
+            return None
+        metrics.inc('media_cache_hits')
+        entries.move_to_end((variant, md5))
+        connection.execute('UPDATE entries SET accessed=? WHERE variant=? AND md5=?', (time.time(), variant, md5))
+        return path_for(variant, md5, entry[0])
+
+def store(variant, md5, ext, source):
+    global total_size
+    assert variant in VARIANTS
+    open_index()
+    path = path_for(variant, md5, ext)
+    with lock:
+        if (variant, md5) in entries:
+            entries.move_to_end((variant, md5))
+            stored = True
+        else:
+            stored = False
+    if stored:
+        if isinstance(source, str):
+            try: os.remove(source)
+            except OSError: pass
+        else:
+            source.discard()
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if isinstance(source, str):
+        shutil.move(source, path)
+    else:
+        source.move(path)
+    size = os.path.getsize(path)
+    with lock:
+        if (variant, md5) in entries:
+            entries.move_to_end((variant, md5))
+            return path
+        entries[(variant, md5)] = (ext, size)
+        total_size += size
+        connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', (variant, md5, ext, size, time.time()))
+        evict(config.MEDIA_CACHE_BYTES, (variant, md5))
+        return path
+
+def evict(limit, keep=None):
+    global total_size
+    with lock:
+        victims = []
+        for key, (ext, size) in entries.items():
+            if total_size <= limit:
+                break
+            if key == keep:
+                continue
+            victims.append(key)
+            total_size -= size
+        for variant, md5 in victims:
+            ext, size = entries.pop((variant, md5))
+            try: os.remove(path_for(variant, md5, ext))
+            except OSError: pass
+        connection.executemany('DELETE FROM entries WHERE variant=? AND md5=?', victims)
+        metrics.inc('media_cache_evictions', len(victims))
+        return len(victims)
+
+def clear():
+    return evict(0)
+
+metrics.gauge('media_cache_bytes', lambda: total_size)
@@ -0,0 +1,151 @@
+import configparser
+import threading
+import sqlite3
+import config
+import json
+import ast
+import os
+
+SCHEMA_VERSION = 2
+
+lock = threading.RLock()
+connection = None
+
+def open_store():
+    global connection
+    with lock:
+        if not connection == None:
+            return connection
+        directory = os.path.dirname(config.METADATA_DB)
+        if not directory == '' and not os.path.exists(directory):
+            os.makedirs(directory)
+        connection = sqlite3.connect(config.METADATA_DB, check_same_thread=False, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        if connection.execute('PRAGMA user_version').fetchone()[0] < 1:
+            connection.execute('CREATE TABLE IF NOT EXISTS posts (id INTEGER PRIMARY KEY, md5 TEXT, file_path TEXT, data TEXT)')
+            connection.execute('CREATE INDEX IF NOT EXISTS posts_md5 ON posts (md5)')
+        if connection.execute('PRAGMA user_version').fetchone()[0] < 2:
+            connection.execute('CREATE TABLE IF NOT EXISTS pending (id INTEGER PRIMARY KEY, md5 TEXT, file_url TEXT, file_path TEXT, data TEXT)')
+            connection.execute('PRAGMA user_version=%d' % SCHEMA_VERSION)
+        if os.path.exists(config.METADATA):
+            migrate(config.METADATA)
+        return connection
+
+def migrate(path):
+    parser = configparser.ConfigParser()
+    with open(path, encoding='utf8') as src_file:
+        parser.read_file(src_file)
+    rows = []
+    for section in parser.sections():
+        if not section.isdigit():
+            continue
+        data = dict()
+        for key, value in parser.items(section, raw=True):
+            if key == 'file_path':
+                continue
+            try: data[key] = ast.literal_eval(value.replace('%%', '%'))
+            except (ValueError, SyntaxError): data[key] = value
+        rows.append((int(section), data.get('md5'), parser[section].get('file_path'), json.dumps(data)))
+    with lock:
+        connection.execute('BEGIN')
+        try:
+            connection.executemany('INSERT OR IGNORE INTO posts VALUES (?, ?, ?, ?)', rows)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+    os.replace(path, path + '.migrated')
+    print('Migrated', len(rows), 'posts from', path)
+
+def row(post, file_path):
+    return (post.id, post.md5, file_path, json.dumps(dict(post.reduce_data())))
+
+def pending_row(post, file_path):
+    return (post.id, post.md5, post.file_url, file_path, json.dumps(dict(post.reduce_data(), file_size=post.file_size)))
+
+def contains(post_id):
+    open_store()
+    with lock:
+        return not connection.execute('SELECT 1 FROM posts WHERE id=?', (post_id,)).fetchone() == None
+
+def get(post_id):
+    open_store()
+    with lock:
+        found = connection.execute('SELECT md5, file_path, data FROM posts WHERE id=?', (post_id,)).fetchone()
+    if found == None:
+        return None
+    data = json.loads(found[2])
+    data['md5'] = found[0]
+    data['file_path'] = found[1]
+    return data
+
+def add(post, file_path):
+    add_many([row(post, file_path)])
+
+def add_many(rows):
+    if len(rows) == 0:
+        return
+    open_store()
+    with lock:
+        connection.execute('BEGIN')
+        try:
+            connection.executemany('INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?)', rows)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+def find_md5(md5):
+    if md5 == None:
+        return None
+    open_store()
+    with lock:
+        paths = connection.execute('SELECT file_path FROM posts WHERE md5=?', (md5,)).fetchall()
+    for path, in paths:
+        if not path == None and os.path.exists(path):
+            return path
+    return None
+
+def enqueue(rows):
+    open_store()
+    with lock:
+        connection.execute('BEGIN')
+        try:
+            connection.executemany('INSERT OR IGNORE INTO pending SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM posts WHERE id=?)',
+                                   [row + (row[0],) for row in rows])
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+def pending():
+    open_store()
+    with lock:
+        return connection.execute('SELECT id, md5, file_url, file_path, data FROM pending ORDER BY id DESC').fetchall()
+
+def complete(rows):
+    if len(rows) == 0:
+        return
+    open_store()
+    with lock:
+        connection.execute('BEGIN')
+        try:
+            connection.executemany('INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?)', rows)
+            connection.executemany('DELETE FROM pending WHERE id=?', [(row[0],) for row in rows])
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+def count():
+    open_store()
+    with lock:
+        return connection.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
+
+def close():
+    global connection
+    with lock:
+        if not connection == None:
+            connection.close()
+            connection = None
@@ -0,0 +1,147 @@
+import threading
+import config
+import json
+import time
+import os
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+lock = threading.Lock()
+histograms = dict()
+counters = dict()
+gauges = dict()
+exporter = None
+exporter_stop = threading.Event()
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if self.count == 0:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+        return self.buckets[-1]
+
+    def snapshot(self):
+        return {
+            'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count > 0 else 0,
+            'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99)
+        }
+
+def observe(name, seconds):
+    with lock:
+        histogram = histograms.get(name)
+        if histogram == None:
+            histogram = histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+def timed(name, func, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        observe(name, time.perf_counter() - started)
+
+def inc(name, amount=1):
+    with lock:
+        counters[name] = counters.get(name, 0) + amount
+
+def gauge(name, value):
+    with lock:
+        gauges[name] = value
+
+def read_gauges():
+    with lock:
+        items = list(gauges.items())
+    values = dict()
+    for name, value in items:
+        if callable(value):
+            try: value = value()
+            except Exception: value = None
+        values[name] = value
+    return values
+
+def snapshot():
+    values = read_gauges()
+    with lock:
+        return {
+            'time': time.time(),
+            'histograms': dict((name, histogram.snapshot()) for name, histogram in histograms.items()),
+            'counters': dict(counters),
+            'gauges': values
+        }
+
+def prometheus(prefix='e621dl_'):
+    values = read_gauges()
+    lines = []
+    with lock:
+        for name, histogram in sorted(histograms.items()):
+            metric = prefix + name + '_seconds'
+            lines.append('# TYPE %s histogram' % metric)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append('%s_bucket{le="%s"} %d' % (metric, bound, cumulative))
+            lines.append('%s_sum %f' % (metric, histogram.sum))
+            lines.append('%s_count %d' % (metric, histogram.count))
+        for name, value in sorted(counters.items()):
+            lines.append('# TYPE %s%s_total counter' % (prefix, name))
+            lines.append('%s%s_total %s' % (prefix, name, value))
+    for name, value in sorted(values.items()):
+        if isinstance(value, (int, float)):
+            lines.append('# TYPE %s%s gauge' % (prefix, name))
+            lines.append('%s%s %s' % (prefix, name, value))
+    return '\n'.join(lines) + '\n'
+
+def write(path, text):
+    directory = os.path.dirname(path)
+    if not directory == '' and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path + '.tmp', 'w', encoding='utf8') as tgt_file:
+        tgt_file.write(text)
+    os.replace(path + '.tmp', path)
+
+def export():
+    if not config.METRICS_JSON == None:
+        write(config.METRICS_JSON, json.dumps(snapshot(), indent=2))
+    if not config.METRICS_PROM == None:
+        write(config.METRICS_PROM, prometheus())
+
+def run_exporter(interval):
+    while not exporter_stop.wait(interval):
+        try: export()
+        except OSError as e: print('Failed to export metrics:', e)
+
+def start_export(interval=None):
+    global exporter
+    if exporter == None:
+        exporter_stop.clear()
+        exporter = threading.Thread(target=run_exporter, name='Metrics', args=(interval or config.METRICS_INTERVAL,), daemon=True)
+        exporter.start()
+
+def stop_export():
+    global exporter
+    if not exporter == None:
+        exporter_stop.set()
+        exporter.join()
+        exporter = None
+        export()
+
+gauge('threads', threading.active_count)
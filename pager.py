@@ -0,0 +1,97 @@
+import threading
+import workers
+import engine
+import config
+import api
+
+class Pager:
+    def __init__(self, tags='', limit=75, prefetch=config.PREFETCH_PAGES):
+        self.tags = tags
+        self.limit = limit
+        self.prefetch = prefetch
+        self.cursors = not any(tag.startswith('order:') for tag in tags.split())
+        self.pages = dict()
+        self.before = dict()
+        self.partial = dict()
+        self.lock = threading.Lock()
+        self.arrived = threading.Condition(self.lock)
+        self.loader = workers.WorkerPool(1, 'Pager')
+
+    def request(self, page, priority=engine.PRIORITY_PREFETCH):
+        with self.lock:
+            future = self.pages.get(page)
+            if future == None or (future.done() and (future.cancelled() or not future.exception() == None)):
+                future = self.pages[page] = self.loader.submit(self.load, page, priority)
+            return future
+
+    def load(self, page, priority):
+        params = { 'tags': self.tags }
+        if page in self.before:
+            params['before_id'] = self.before[page]
+        elif page > config.MAX_PAGE:
+            return []
+        else:
+            params['page'] = page
+        with self.lock:
+            posts = self.partial[page] = []
+        try:
+            for post in api.search(self.limit, priority=priority, **params):
+                with self.arrived:
+                    posts.append(post)
+                    self.arrived.notify_all()
+        finally:
+            with self.lock:
+                del self.partial[page]
+        if self.cursors and len(posts) > 0:
+            self.before[page + 1] = posts[-1].id
+        return posts
+
+    def get(self, page):
+        posts = self.request(page, engine.PRIORITY_VISIBLE).result()
+        self.prefetch_after(page, posts)
+        return posts
+
+    def stream(self, page, listener):
+        future = self.request(page, engine.PRIORITY_VISIBLE)
+        future.add_done_callback(self.wake)
+        delivered = 0
+        while True:
+            with self.arrived:
+                self.arrived.wait_for(lambda: future.done() or len(self.partial.get(page, ())) > delivered)
+                if future.done():
+                    break
+                fresh = self.partial[page][delivered:]
+            for post in fresh:
+                listener(post)
+            delivered += len(fresh)
+        posts = future.result()
+        for post in posts[delivered:]:
+            listener(post)
+        self.prefetch_after(page, posts)
+        return posts
+
+    def wake(self, future):
+        with self.arrived:
+            self.arrived.notify_all()
+
+    def prefetch_after(self, page, posts):
+        if len(posts) == self.limit:
+            for npage in range(page + 1, page + 1 + self.prefetch):
+                self.request(npage)
+
+    def retain(self, first, last):
+        with self.lock:
+            for page in [page for page in self.pages if page < first or page > last + self.prefetch]:
+                del self.pages[page]
+
+    def __iter__(self):
+        page = 1
+        while True:
+            posts = self.get(page)
+            if len(posts) == 0:
+                return
+            yield posts
+            page += 1
+
+    def close(self):
+        self.loader.stop()
@@ -1,396 +1,299 @@
 from pyglet import image
-import threading
+import mediacache
 import download
+import hashlib
 import tempfile
+import engine
 import config
 import api
+import json
+import sys
 import os
 import time
-import tools
+import metrics
+import logging
+
+FIELDS = (
+    'id', 'md5', 'rating', 'score', 'fav_count', 'tags', 'width', 'height',
+    'file_ext', 'file_size', 'file_url', 'preview_url', 'preview_width', 'preview_height',
+    'sample_url', 'sample_width', 'sample_height'
+)
+INTERNED = ('rating', 'file_ext')
 
 class Post:
+    __slots__ = FIELDS + (
+        '_extra', 'temp_file', 'temp_sample', 'temp_preview', 'file_image', 'sample_image', 'preview_image',
+        'loading_file', 'loading_sample', 'loading_preview', 'column', 'row', '__weakref__'
+    )
+
     def __init__(self, data):
-        self.data = data
+        data = dict(data)
+        for key in FIELDS:
+            value = data.pop(key, None)
+            if key in INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+        self._extra = json.dumps(data, separators=(',', ':')) if len(data) > 0 else None
         self.temp_file = None
+        self.temp_sample = None
         self.temp_preview = None
         self.file_image = None
-        self.loading_file = threading.Event()
+        self.loading_file = False
+        self.sample_image = None
+        self.loading_sample = False
         self.preview_image = None
-        self.loading_preview = threading.Event()
-        self._message = None
+        self.loading_preview = False
         self.column = 0
         self.row = 0
     
     def get_file(self):
         if self.temp_file == None:
-            fd, self.temp_file = tempfile.mkstemp('_e621dl.'+self.file_ext, str(self.id))
-            with open(self.temp_file, 'w') as temp:
+            self.temp_file = mediacache.lookup('file', self.cache_key)
+        if self.temp_file == None:
+            fd, path = tempfile.mkstemp('_e621dl.'+self.file_ext, str(self.id))
+            with open(path, 'w') as temp:
                 download.download_file(self.file_url, temp)
             os.close(fd)
+            self.temp_file = mediacache.store('file', self.cache_key, self.file_ext, path)
         return self.temp_file
 
     def get_preview(self):
         if self.temp_preview == None:
-            extension = self.preview_url[::-1].split('.')[0][::-1]
-            fd, self.temp_preview = tempfile.mkstemp('_e621dl.'+extension, str(self.id))
-            with open(self.temp_preview, 'w') as temp:
+            self.temp_preview = mediacache.lookup('preview', self.cache_key)
+        if self.temp_preview == None:
+            fd, path = tempfile.mkstemp('_e621dl.'+self.variant_ext('preview'), str(self.id))
+            with open(path, 'w') as temp:
                 download.download_file(self.preview_url, temp)
             os.close(fd)
+            self.temp_preview = mediacache.store('preview', self.cache_key, self.variant_ext('preview'), path)
         return self.temp_preview
 
-    def load_preview(self, file_handler=lambda x:None):
-        if self.preview_image == None:
-            if not self.loading_preview.is_set():
-                self.loading_preview.set()
-                clear_load_flag = lambda e: self.loading_preview.clear()
-                def response_handler(response):
-                    if self.temp_preview == None:
-                        size = len(response.content)
-                        delay = tools.get_delay(self)
-                        self.print(tools.format_data(size, 2) + '  \t' + str(round(delay, 2)) + ' s    \t' + tools.format_data(size/delay, 2) + '/s')
-                        ext = self.preview_url[::-1].split('.')[0][::-1]
-                        fd, temp_preview = tempfile.mkstemp('_preview_e621dl.'+ext, str(self.id), tempfile.gettempdir() + config.TEMP_SUBD_DIR)
-                        with open(temp_preview, 'wb') as outfile:
-                            outfile.write(response.content)
-                        #self.print('Downloaded ' + str(self.id) + ' preview')
-                        os.close(fd)
-                        self.temp_preview = temp_preview
-                    try:
-                        file_handler((self, self.temp_preview))
-                        clear_load_flag(None)
-                    except Exception as e:
-                        self.print(e)
-                tools.rec_delay(self)
-                api.queue_request(self.preview_url, response_handler=response_handler, error_handler=clear_load_flag)
-            return None
-        return self.preview_image
+    def load_preview(self, file_handler=lambda x:None, priority=engine.PRIORITY_VISIBLE, token=None):
+        return self.load('preview', file_handler, priority, token)
 
-    def load_file(self, file_handler=lambda x:None):
-        if self.file_image == None:
-            if not self.loading_file.is_set():
-                self.loading_file.set()
-                clear_load_flag = lambda e: self.loading_file.clear()
-                def response_handler(response):
-                    if self.temp_file == None:
-                        size = len(response.content)
-                        delay = tools.get_delay(self)
-                        self.print(tools.format_data(size, 2) + '  \t' + str(round(delay, 2)) + ' s    \t' + tools.format_data(size/delay, 2) + '/s')
-                        fd, temp_file = tempfile.mkstemp('_e621dl.'+self.file_ext, str(self.id), tempfile.gettempdir() + config.TEMP_SUBD_DIR)
-                        with open(temp_file, 'wb') as outfile:
-                            outfile.write(response.content)
-                        #self.print('Downloaded ' + str(self.id))
-                        os.close(fd)
-                        self.temp_file = temp_file
+    def load_sample(self, file_handler=lambda x:None, priority=engine.PRIORITY_VISIBLE, token=None):
+        return self.load('sample', file_handler, priority, token)
+
+    def load_file(self, file_handler=lambda x:None, priority=engine.PRIORITY_FILE, token=None):
+        return self.load('file', file_handler, priority, token)
+
+    def load(self, variant, file_handler=lambda x:None, priority=engine.PRIORITY_FILE, token=None):
+        if getattr(self, variant + '_image') == None:
+            if not getattr(self, 'loading_' + variant):
+                setattr(self, 'loading_' + variant, True)
+                def clear_load_flag(e):
+                    setattr(self, 'loading_' + variant, False)
+                def cached_handler():
                     try:
-                        file_handler((self, self.temp_file))
+                        file_handler((self, getattr(self, 'temp_' + variant), variant))
                         clear_load_flag(None)
-                    except Exception as e:
-                        self.print(e)
-                tools.rec_delay(self)
-                api.queue_request(self.file_url, response_handler=response_handler, error_handler=clear_load_flag)
+                    except Exception:
+                        metrics.inc('handler_errors')
+                        logging.exception('Failed to handle %s %s', variant, self.id)
+                def response_handler(response):
+                    if getattr(self, 'temp_' + variant) == None:
+                        metrics.inc(variant + '_downloads')
+                        metrics.inc(variant + '_bytes', response.size)
+                        try:
+                            setattr(self, 'temp_' + variant, mediacache.store(variant, self.cache_key, self.variant_ext(variant), response))
+                        except Exception:
+                            metrics.inc('handler_errors')
+                            logging.exception('Failed to store %s %s', variant, self.id)
+                            clear_load_flag(None)
+                            return
+                    cached_handler()
+                if getattr(self, 'temp_' + variant) == None:
+                    setattr(self, 'temp_' + variant, mediacache.lookup(variant, self.cache_key))
+                if not getattr(self, 'temp_' + variant) == None:
+                    engine.dispatch(cached_handler)
+                    return None
+                api.queue_request(self.variant_url(variant), response_handler=response_handler, error_handler=clear_load_flag, priority=priority, token=token, to_file=True)
             return None
-        return self.file_image
+        return getattr(self, variant + '_image')
+
+    def variant_url(self, variant):
+        return getattr(self, variant + '_url')
+
+    def variant_size(self, variant):
+        if variant == 'file':
+            return (self.width, self.height)
+        return (getattr(self, variant + '_width'), getattr(self, variant + '_height'))
+
+    def variant_ext(self, variant):
+        if variant == 'file':
+            return self.file_ext
+        return self.variant_url(variant)[::-1].split('.')[0][::-1]
+
+    def variant_for(self, width, height):
+        available = [variant for variant in mediacache.VARIANTS if not self.variant_url(variant) == None and not None in self.variant_size(variant)]
+        for variant in available:
+            w, h = self.variant_size(variant)
+            if w >= width and h >= height:
+                return variant
+        if len(available) == 0:
+            return 'file'
+        return available[-1]
 
     def clear_cache(self):
-        status = True
-        if not self.temp_preview == None:
-            try:
-                os.remove(self.temp_preview)
-                self.temp_preview = None
-            except: status = False
-        if not self.temp_file == None:
-            try:
-                os.remove(self.temp_file)
-            except Exception as e:
-                print(e)
-                status = False
+        self.temp_preview = None
+        self.temp_sample = None
         self.temp_file = None
-        if not self.file_image == None:
-            del self.file_image
+        self.sample_image = None
         self.file_image = None
-        return status
-
-    def print(self, *args):
-        if len(args) > 0:
-            s = args[0]
-            for e in args[1:]:
-                s += ' ' + str(e)
-            if not self._message == None:
-                self._message += '\n' + s
-            else:
-                self._message = s
+        return True
 
     def download(self, tgt_dir=config.DOWNLOADS):
-        parser = download.load_parser()
-        download.download_post(parser, self, tgt_dir)
-        download.save_parser(parser)
+        download.download_posts([self], tgt_dir)
 
     def reduce_data(self):
+        data = self.data
         for key in config.META_TAGS:
-            yield (key, repr(self.data.get(key)).replace('%', '%%'))
+            yield (key, data.get(key))
 
     def open(self):
         try: os.system('start '+config.BASE_URL+'/post/show/'+str(self.id))
         except: print('Failed to open post url. <%s>' % self.id)
 
     @property
-    def message(self):
-        ret = self._message
-        self._message = None
-        return ret
+    def data(self):
+        data = self.extra
+        for key in FIELDS:
+            data[key] = getattr(self, key)
+        return data
+
+    @property
+    def extra(self):
+        if self._extra == None:
+            return dict()
+        return json.loads(self._extra)
+
+    def set_extra(self, key, value):
+        extra = self.extra
+        extra[key] = value
+        self._extra = json.dumps(extra, separators=(',', ':'))
+
+    @property
+    def cache_key(self):
+        if self.md5 == None:
+            return hashlib.md5(self.file_url.encode('utf8')).hexdigest()
+        return self.md5
 
     @property
     def artist(self):
-        return self.data['artist']
+        return self.extra['artist']
 
     @artist.setter
     def artist(self, value):
-        self.data['artist'] = value
+        self.set_extra('artist', value)
 
     @property
     def author(self):
-        return self.data['author']
+        return self.extra['author']
 
     @author.setter
     def author(self, value):
-        self.data['author'] = value
+        self.set_extra('author', value)
 
     @property
     def change(self):
-        return self.data['change']
+        return self.extra['change']
 
     @change.setter
     def change(self, value):
-        self.data['change'] = value
+        self.set_extra('change', value)
 
     @property
     def children(self):
-        return self.data['children']
+        return self.extra['children']
 
     @children.setter
     def children(self, value):
-        self.data['children'] = value
+        self.set_extra('children', value)
 
     @property
     def created_at(self):
-        return self.data['created_at']
+        return self.extra['created_at']
 
     @created_at.setter
     def created_at(self, value):
-        self.data['created_at'] = value
+        self.set_extra('created_at', value)
 
     @property
     def creator_id(self):
-        return self.data['creator_id']
+        return self.extra['creator_id']
 
     @creator_id.setter
     def creator_id(self, value):
-        self.data['creator_id'] = value
+        self.set_extra('creator_id', value)
 
     @property
     def description(self):
-        return self.data['description']
+        return self.extra['description']
 
     @description.setter
     def description(self, value):
-        self.data['description'] = value
-
-    @property
-    def fav_count(self):
-        return self.data['fav_count']
-
-    @fav_count.setter
-    def fav_count(self, value):
-        self.data['fav_count'] = value
-
-    @property
-    def file_ext(self):
-        return self.data['file_ext']
-
-    @file_ext.setter
-    def file_ext(self, value):
-        self.data['file_ext'] = value
-
-    @property
-    def file_size(self):
-        return self.data['file_size']
-
-    @file_size.setter
-    def file_size(self, value):
-        self.data['file_size'] = value
-
-    @property
-    def file_url(self):
-        return self.data['file_url']
-
-    @file_url.setter
-    def file_url(self, value):
-        self.data['file_url'] = value
+        self.set_extra('description', value)
 
     @property
     def has_children(self):
-        return self.data['has_children']
+        return self.extra['has_children']
 
     @has_children.setter
     def has_children(self, value):
-        self.data['has_children'] = value
+        self.set_extra('has_children', value)
 
     @property
     def has_comments(self):
-        return self.data['has_comments']
+        return self.extra['has_comments']
 
     @has_comments.setter
     def has_comments(self, value):
-        self.data['has_comments'] = value
+        self.set_extra('has_comments', value)
 
     @property
     def has_notes(self):
-        return self.data['has_notes']
+        return self.extra['has_notes']
 
     @has_notes.setter
     def has_notes(self, value):
-        self.data['has_notes'] = value
-
-    @property
-    def height(self):
-        return self.data['height']
-
-    @height.setter
-    def height(self, value):
-        self.data['height'] = value
-
-    @property
-    def id(self):
-        return self.data['id']
-
-    @id.setter
-    def id(self, value):
-        self.data['id'] = value
+        self.set_extra('has_notes', value)
 
     @property
     def locked_tags(self):
-        return self.data['locked_tags']
+        return self.extra['locked_tags']
 
     @locked_tags.setter
     def locked_tags(self, value):
-        self.data['locked_tags'] = value
-
-    @property
-    def md5(self):
-        return self.data['md5']
-
-    @md5.setter
-    def md5(self, value):
-        self.data['md5'] = value
+        self.set_extra('locked_tags', value)
 
     @property
     def parent_id(self):
-        return self.data['parent_id']
+        return self.extra['parent_id']
 
     @parent_id.setter
     def parent_id(self, value):
-        self.data['parent_id'] = value
-
-    @property
-    def preview_height(self):
-        return self.data['preview_height']
-
-    @preview_height.setter
-    def preview_height(self, value):
-        self.data['preview_height'] = value
-
-    @property
-    def preview_url(self):
-        return self.data['preview_url']
-
-    @preview_url.setter
-    def preview_url(self, value):
-        self.data['preview_url'] = value
-
-    @property
-    def preview_width(self):
-        return self.data['preview_width']
-
-    @preview_width.setter
-    def preview_width(self, value):
-        self.data['preview_width'] = value
-
-    @property
-    def rating(self):
-        return self.data['rating']
-
-    @rating.setter
-    def rating(self, value):
-        self.data['rating'] = value
-
-    @property
-    def sample_height(self):
-        return self.data['sample_height']
-
-    @sample_height.setter
-    def sample_height(self, value):
-        self.data['sample_height'] = value
-
-    @property
-    def sample_url(self):
-        return self.data['sample_url']
-
-    @sample_url.setter
-    def sample_url(self, value):
-        self.data['sample_url'] = value
-
-    @property
-    def sample_width(self):
-        return self.data['sample_width']
-
-    @sample_width.setter
-    def sample_width(self, value):
-        self.data['sample_width'] = value
-
-    @property
-    def score(self):
-        return self.data['score']
-
-    @score.setter
-    def score(self, value):
-        self.data['score'] = value
+        self.set_extra('parent_id', value)
 
     @property
     def source(self):
-        return self.data['source']
+        return self.extra['source']
 
     @source.setter
     def source(self, value):
-        self.data['source'] = value
+        self.set_extra('source', value)
 
     @property
     def sources(self):
-        return self.data['sources']
+        return self.extra['sources']
 
     @sources.setter
     def sources(self, value):
-        self.data['sources'] = value
+        self.set_extra('sources', value)
 
     @property
     def status(self):
-        return self.data['status']
+        return self.extra['status']
 
     @status.setter
     def status(self, value):
-        self.data['status'] = value
-
-    @property
-    def tags(self):
-        return self.data['tags']
-
-    @tags.setter
-    def tags(self, value):
-        self.data['tags'] = value
-
-    @property
-    def width(self):
-        return self.data['width']
-
-    @width.setter
-    def width(self, value):
-        self.data['width'] = value
\ No newline at end of file
+        self.set_extra('status', value)
\ No newline at end of file
@@ -0,0 +1,93 @@
+from array import array
+
+COLUMNS = {
+    'id': 'q', 'file_size': 'q', 'width': 'l', 'height': 'l',
+    'preview_width': 'l', 'preview_height': 'l', 'score': 'l', 'fav_count': 'l',
+}
+
+class PostStore:
+    def __init__(self, posts=()):
+        self.posts = []
+        self.rows = dict()
+        self.columns = { key: array(code) for key, code in COLUMNS.items() }
+        self.ratings = array('B')
+        self.tag_ids = array('L')
+        self.tag_offsets = array('L', [0])
+        self.tag_index = dict()
+        self.tag_names = []
+        self.extend(posts)
+
+    def __len__(self):
+        return len(self.posts)
+
+    def __getitem__(self, row):
+        return self.posts[row]
+
+    def __contains__(self, post_id):
+        return post_id in self.rows
+
+    def tag_id(self, tag):
+        if not tag in self.tag_index:
+            self.tag_index[tag] = len(self.tag_names)
+            self.tag_names.append(tag)
+        return self.tag_index[tag]
+
+    def add(self, post):
+        if post.id in self.rows:
+            return self.rows[post.id]
+        row = len(self.posts)
+        self.rows[post.id] = row
+        self.posts.append(post)
+        for key, column in self.columns.items():
+            column.append(getattr(post, key) or 0)
+        self.ratings.append(ord(post.rating or '?'))
+        self.tag_ids.extend(sorted(self.tag_id(tag) for tag in (post.tags or '').split()))
+        self.tag_offsets.append(len(self.tag_ids))
+        return row
+
+    def extend(self, posts):
+        for post in posts:
+            self.add(post)
+
+    def tags_of(self, row):
+        return self.tag_ids[self.tag_offsets[row]:self.tag_offsets[row+1]]
+
+    def has_tag(self, row, tag_id):
+        tags = self.tags_of(row)
+        low, high = 0, len(tags)
+        while low < high:
+            mid = (low + high) // 2
+            if tags[mid] < tag_id:
+                low = mid + 1
+            else:
+                high = mid
+        return low < len(tags) and tags[low] == tag_id
+
+    def filter(self, rows=None, rating=None, min_score=None, tags=(), exclude=()):
+        if rows == None:
+            rows = range(len(self.posts))
+        if not rating == None:
+            allowed = set(ord(r) for r in rating)
+            ratings = self.ratings
+            rows = [row for row in rows if ratings[row] in allowed]
+        if not min_score == None:
+            scores = self.columns['score']
+            rows = [row for row in rows if scores[row] >= min_score]
+        for tag in tags:
+            if not tag in self.tag_index:
+                return []
+            tag_id = self.tag_index[tag]
+            rows = [row for row in rows if self.has_tag(row, tag_id)]
+        for tag in exclude:
+            if tag in self.tag_index:
+                tag_id = self.tag_index[tag]
+                rows = [row for row in rows if not self.has_tag(row, tag_id)]
+        return list(rows)
+
+    def sort(self, key, rows=None, reverse=False):
+        if rows == None:
+            rows = range(len(self.posts))
+        return sorted(rows, key=self.columns[key].__getitem__, reverse=reverse)
+
+    def select(self, rows):
+        return [self.posts[row] for row in rows]
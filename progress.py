@@ -0,0 +1,69 @@
+import threading
+import config
+import tools
+import time
+import sys
+
+lock = threading.Lock()
+transfers = []
+renderer = None
+totals = { 'files': 0, 'bytes': 0 }
+
+class Transfer:
+    def __init__(self, name, size=None):
+        self.name = name
+        self.size = size
+        self.received = 0
+
+    def update(self, amount):
+        self.received += amount
+
+    def finish(self):
+        with lock:
+            if self in transfers:
+                transfers.remove(self)
+                totals['files'] += 1
+                totals['bytes'] += self.received
+
+def start(name, size=None):
+    global renderer
+    transfer = Transfer(name, size)
+    with lock:
+        transfers.append(transfer)
+        if renderer == None:
+            renderer = threading.Thread(target=render_loop, name='Progress', daemon=True)
+            renderer.start()
+    return transfer
+
+def render_loop():
+    global renderer
+    width = 0
+    last = time.perf_counter()
+    last_bytes = None
+    while True:
+        time.sleep(config.PROGRESS_INTERVAL)
+        with lock:
+            active = list(transfers)
+            done_files, done_bytes = totals['files'], totals['bytes']
+            if len(active) == 0:
+                renderer = None
+        received = done_bytes + sum(transfer.received for transfer in active)
+        now = time.perf_counter()
+        rate = 0 if last_bytes == None else (received - last_bytes) / (now - last)
+        last, last_bytes = now, received
+        line = render(active, done_files, received, rate)
+        sys.stdout.write('\r' + line + ' ' * max(width - len(line), 0))
+        width = len(line)
+        if len(active) == 0:
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+            return
+        sys.stdout.flush()
+
+def render(active, done_files, received, rate):
+    sizes = [transfer.size for transfer in active]
+    line = '    Downloading %d file(s), %d done... ' % (len(active), done_files)
+    if len(active) > 0 and not None in sizes:
+        current = sum(transfer.received for transfer in active)
+        line += tools.gauge(current / max(sum(sizes), 1), 20) + ' '
+    return line + tools.format_data(received, 2) + '  ' + tools.format_data(rate, 2) + '/s'
@@ -0,0 +1,47 @@
+from urllib.parse import urlsplit
+import threading
+import asyncio
+import config
+import time
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        with self.lock:
+            now = time.perf_counter()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self, tokens=1):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait(self, tokens=1):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+api_host = urlsplit(config.BASE_URL).netloc
+api_bucket = TokenBucket(config.API_RATE, config.API_BURST)
+media_buckets = dict()
+media_lock = threading.Lock()
+
+def for_url(url):
+    host = urlsplit(url).netloc
+    if host == api_host:
+        return api_bucket
+    with media_lock:
+        if not host in media_buckets:
+            media_buckets[host] = TokenBucket(config.MEDIA_RATE, config.MEDIA_BURST)
+        return media_buckets[host]
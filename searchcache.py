@@ -0,0 +1,106 @@
+from collections import OrderedDict
+import threading
+import jsonstream
+import hashlib
+import metrics
+import engine
+import config
+import json
+import time
+import os
+
+session = OrderedDict()
+session_lock = threading.Lock()
+
+def cache_key(params):
+    params = dict(params)
+    params['tags'] = ' '.join(sorted(str(params.get('tags', '')).split()))
+    if not 'before_id' in params:
+        params['page'] = int(params.get('page', 1))
+    return json.dumps(sorted((str(k), str(v)) for k, v in params.items()))
+
+def entry_path(key):
+    return config.SEARCH_CACHE + hashlib.sha1(key.encode('utf8')).hexdigest() + '.json'
+
+def is_fresh(timestamp):
+    return time.time() - timestamp < config.SEARCH_TTL
+
+def load_entry(key):
+    try:
+        with open(entry_path(key), encoding='utf8') as src_file:
+            return json.load(src_file)
+    except (OSError, ValueError):
+        return None
+
+def save_entry(key, entry):
+    if not os.path.exists(config.SEARCH_CACHE):
+        os.makedirs(config.SEARCH_CACHE)
+    path = entry_path(key)
+    with open(path + '.tmp', 'w', encoding='utf8') as tgt_file:
+        json.dump(entry, tgt_file)
+    os.replace(path + '.tmp', path)
+
+def remember(key, timestamp, posts):
+    with session_lock:
+        session[key] = (timestamp, posts)
+        session.move_to_end(key)
+        while len(session) > config.SEARCH_SESSION:
+            session.popitem(last=False)
+    return posts
+
+def lookup(url, params, parse, priority=engine.PRIORITY_VISIBLE):
+    key = cache_key(params)
+    with session_lock:
+        timestamp, posts = session.get(key, (0, None))
+        if key in session:
+            session.move_to_end(key)
+    if not posts == None and is_fresh(timestamp):
+        metrics.inc('search_cache_hits')
+        yield from posts
+        return
+
+    entry = load_entry(key)
+    if not entry == None and is_fresh(entry['time']):
+        metrics.inc('search_cache_hits')
+        if posts == None:
+            posts = [parse(data) for data in entry['body']]
+        yield from remember(key, entry['time'], posts)
+        return
+
+    headers = {}
+    if not entry == None:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    response = engine.stream(url, params, headers, priority)
+
+    if response.status_code == 304 and not entry == None:
+        metrics.inc('search_cache_revalidated')
+        response.close()
+        entry['time'] = time.time()
+        if posts == None:
+            posts = [parse(data) for data in entry['body']]
+        yield from posts
+    else:
+        metrics.inc('search_cache_misses')
+        entry = {
+            'time': time.time(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'body': []
+        }
+        posts = []
+        try:
+            for data in jsonstream.iter_array(response.iter_content()):
+                entry['body'].append(data)
+                posts.append(parse(data))
+                yield posts[-1]
+        finally:
+            response.close()
+    save_entry(key, entry)
+    remember(key, entry['time'], posts)
+
+def clear_session():
+    with session_lock:
+        session.clear()
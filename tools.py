@@ -8,8 +8,6 @@ GIBIBYTE = 1073741820
 MEBIBYTE = 1048576
 KIBIBYTE = 1024
 
-recorded_delays = list()
-custom_delays = dict()
 transitionCache = dict()
 
 def cacheTransition(id, value): transitionCache[id] = value
@@ -32,6 +30,10 @@ def transition(id, duration, value, mod=LIN, stage=-1):
     cacheTransition(id+'#MEM', nv)
     return nv
 
+def transitioning():
+    now = time.perf_counter()*1000
+    return any(now < v[0] for v in transitions.values())
+
 def constrain(val, min, max):
     if val < min:
         return min
@@ -107,17 +109,3 @@ def getNum(query, **kwargs):
             return i
         except ValueError:
             print(error)
-
-def rec_delay(index=None):
-    global recorded_delays, custom_delays
-    if index == None:
-        recorded_delays.append(time.perf_counter())
-    else:
-        custom_delays[index] = time.perf_counter()
-
-def get_delay(index=None):
-    global recorded_delays, custom_delays
-    if index == None:
-        return time.perf_counter() - recorded_delays.pop()
-    else:
-        return time.perf_counter() - custom_delays.pop(index)
\ No newline at end of file
@@ -0,0 +1,55 @@
+from concurrent.futures import Future
+import threading
+import queue
+
+STOP = object()
+
+class WorkerPool:
+    def __init__(self, size=1, name='Worker'):
+        self.queue = queue.Queue()
+        self.stopping = False
+        self.threads = []
+        for i in range(size):
+            process = threading.Thread(target=self.run, name=name+'-'+str(i+1), daemon=True)
+            self.threads.append(process)
+            process.start()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        if self.stopping:
+            future.cancel()
+        else:
+            self.queue.put_nowait((future, func, args, kwargs))
+        return future
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is STOP:
+                return
+            future, func, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def stop(self):
+        self.stopping = True
+        while True:
+            try: item = self.queue.get_nowait()
+            except queue.Empty: break
+            if not item is STOP:
+                item[0].cancel()
+        for process in self.threads:
+            self.queue.put_nowait(STOP)
+
+    def join(self):
+        for process in self.threads:
+            if not process is threading.current_thread():
+                process.join()
+
+    def shutdown(self):
+        self.stop()
+        self.join()